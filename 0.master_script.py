@@ -0,0 +1,83 @@
+import argparse
+import os
+import sys
+import compact
+import parallel_match
+import reference_cache
+import stage_cache
+from fetch import EXIT_UNCHANGED, DownloadError
+from pipeline import CHECKPOINT_TABLES, STAGES, run_pipeline
+from profiling import REPORTS_DIRNAME, RunReport
+from store import EXPORT_SHEETS_ENV, WORKBOOK_SHEETS, get_data_dir
+
+# =====================
+# STEP 0: RUN THE WHOLE PIPELINE IN ONE PROCESS
+# =====================
+# Everything runs under the __main__ guard, as worker processes for parallel
+# fuzzy matching may import this script again.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the UNRWA truck pipeline steps in one process.")
+    parser.add_argument('--from', dest='first', type=int, default=1,
+                        help="First step to run. Its input table must have been checkpointed by an earlier run.")
+    parser.add_argument('--to', dest='last', type=int, default=len(STAGES), help="Last step to run.")
+    parser.add_argument('--only', type=int, nargs='+', help="Run only these steps.")
+    parser.add_argument('--checkpoint', nargs='+', default=[], choices=CHECKPOINT_TABLES + ['all'],
+                        help="Tables to save to the intermediate store so later runs can resume from them.")
+    parser.add_argument('--date', help="Run against the 'UNRWA Truck Data_YYYYMMDD' folder of this date instead of today.")
+    parser.add_argument('--force', action='store_true', help="Process the Supply Page export even if it has not changed.")
+    parser.add_argument('--compact', action='store_true',
+                        help="Use categoricals and narrow numeric types to cut memory use (same as UNRWA_COMPACT=1).")
+    parser.add_argument('--workers', type=int,
+                        help="Fuzzy match items on this many worker processes, 0 for every core (same as UNRWA_MATCH_WORKERS).")
+    parser.add_argument('--chunk-size', type=int,
+                        help="Items per chunk sent to a fuzzy matching worker (same as UNRWA_MATCH_CHUNK_SIZE).")
+    parser.add_argument('--sheets', nargs='+', choices=WORKBOOK_SHEETS,
+                        help="Only export these sheets to the workbook (same as UNRWA_EXPORT_SHEETS).")
+    parser.add_argument('--kcal-reference-version',
+                        help="Use this cached version of kcal_reference.xlsx (same as UNRWA_KCAL_REFERENCE_VERSION).")
+    parser.add_argument('--no-stage-cache', action='store_true',
+                        help="Run every step even if its inputs haven't changed (same as UNRWA_STAGE_CACHE=0).")
+    parser.add_argument('--profile', action='store_true', help="Also save a cProfile dump of every step in the reports folder.")
+    args = parser.parse_args()
+
+    if args.compact:
+        os.environ[compact.COMPACT_ENV] = '1'
+    if args.sheets:
+        os.environ[EXPORT_SHEETS_ENV] = ','.join(args.sheets)
+    if args.workers is not None:
+        os.environ[parallel_match.WORKERS_ENV] = str(args.workers)
+    if args.chunk_size is not None:
+        os.environ[parallel_match.CHUNK_SIZE_ENV] = str(args.chunk_size)
+    if args.no_stage_cache:
+        os.environ[stage_cache.STAGE_CACHE_ENV] = '0'
+    if args.kcal_reference_version:
+        os.environ[reference_cache.PIN_VERSION_ENV] = args.kcal_reference_version
+
+    numbers = args.only if args.only else range(args.first, args.last + 1)
+    checkpoints = CHECKPOINT_TABLES if 'all' in args.checkpoint else args.checkpoint
+
+    # Path to the dated data folder
+    data_dir = get_data_dir(args.date)
+
+    # Record timings, memory and counters of every step, with optional cProfile dumps
+    profile_dir = os.path.join(data_dir, REPORTS_DIRNAME, 'profiles') if args.profile else None
+    report = RunReport(profile_dir=profile_dir)
+
+    try:
+        tables = run_pipeline(data_dir, numbers=numbers, checkpoints=checkpoints, force_download=args.force,
+                              report=report)
+    except DownloadError as e:
+        print(f"Failed to download file. {e}")
+        sys.exit(1)
+    except (KeyError, FileNotFoundError, ValueError) as e:
+        print(f"Pipeline stopped: {e}")
+        sys.exit(1)
+    finally:
+        if report.stages:
+            print(report.summary())
+            print(f"Run report saved to {report.write(data_dir)}.")
+
+    if tables is None:
+        sys.exit(EXIT_UNCHANGED)
+
+    print("All steps completed.")
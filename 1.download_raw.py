@@ -1,8 +1,8 @@
-import requests
 import os
-import platform
-from datetime import datetime
-import openpyxl
+import shutil
+from fetch import EXIT_UNCHANGED, DownloadError, download_file, read_state, write_state
+from store import get_cache_dir, get_data_dir, save_table
+from supply_page import is_built_from, read_supply_page, record_raw_export
 
 # ==================
 # DOWNLOAD DATA FROM GOOGLE SHEETS WITHOUT MODIFICATION
@@ -14,119 +14,71 @@ file_id = '19oQZt7zWE29hK6Whnr9zop4gIGUValfxK14fQVHW18s'
 # Construct the export URL to download the spreadsheet as an Excel file
 download_url = f'https://docs.google.com/spreadsheets/d/{file_id}/export?format=xlsx'
 
-# Get the current date in the format YYYYMMDD
-current_date = datetime.now().strftime('%Y%m%d')
+# The URL can be pointed at a local stand-in server for testing
+download_url = os.environ.get('UNRWA_SUPPLY_PAGE_URL', download_url)
 
-# Determine the user's desktop location (macOS and Windows compatibility)
-if platform.system() == "Darwin":  # macOS
-    desktop = os.path.join(os.path.expanduser("~"), "Desktop")
-elif platform.system() == "Windows":  # Windows
-    desktop = os.path.join(os.path.expanduser("~"), "Desktop")
-else:
-    raise Exception("Unsupported operating system. This script works on macOS and Windows only.")
 
-# Create a folder on the desktop with the format "UNRWA Truck Data_YYYYMMDD"
-folder_name = f"UNRWA Truck Data_{current_date}"
-output_dir = os.path.join(desktop, folder_name)
+# Download the export into output_dir and return the 'Supply Page' sheet with 'Quantity'
+# corrected, or None if this folder was already built from the same export
+def run(output_dir, force=False):
+    # Ensure the directory exists
+    os.makedirs(output_dir, exist_ok=True)
 
-# Ensure the directory exists
-os.makedirs(output_dir, exist_ok=True)
+    # Define the final output file name
+    output_file = os.path.join(output_dir, "unrwa_trucks_raw.xlsx")
 
-# Define the final output file name
-output_file = os.path.join(output_dir, "unrwa_trucks_raw.xlsx")
+    # The last downloaded export and its validators are kept in the shared cache folder,
+    # and each dated folder records which export it was built from (see supply_page.py)
+    cache_dir = get_cache_dir()
+    export_file = os.path.join(cache_dir, "supply_page_export.xlsx")
+    export_state_path = os.path.join(cache_dir, "supply_page_export.json")
 
-# Download the file using requests
-print("Downloading the file...")
-response = requests.get(download_url)
+    # Download the file, streaming it to disk and skipping the body if the server reports no change
+    print("Downloading the file...")
+    export_state = download_file(download_url, export_file, previous_state=read_state(export_state_path))
+    write_state(export_state_path, export_state)
 
-if response.status_code == 200:
-    with open(output_file, 'wb') as f:
-        f.write(response.content)
+    # Nothing to do if this folder was already built from the same export, up to the workbook
+    if not force and is_built_from(output_dir, export_state['sha256']):
+        print("The Supply Page export has not changed since the last run. Skipping further processing.")
+        return None
+
+    shutil.copyfile(export_file, output_file)
     print(f"File successfully downloaded and saved as {output_file} without any alterations.")
-else:
-    print(f"Failed to download file. HTTP Status Code: {response.status_code}")
-    exit(1)
 
-# Load the downloaded Excel file
-wb = openpyxl.load_workbook(output_file)
+    # ==================
+    # PROCESS 'Quantity' COLUMN IN 'Supply Page' SHEET
+    # ==================
 
-# Check if 'Suppy Page' exists and rename it to 'Supply Page'
-if 'Suppy Page' in wb.sheetnames:
-    wb['Suppy Page'].title = 'Supply Page'
-    print("Sheet 'Suppy Page' renamed to 'Supply Page'.")
-else:
-    print("No sheet named 'Suppy Page' found. No renaming done.")
+    # Read the 'Supply Page' sheet in a single read-only pass and correct the 'Quantity' column
+    print("Processing 'Supply Page' sheet to correct 'Quantity' column.")
+    data, counters = read_supply_page(output_file)
+    print(f"Processing complete. {counters['rows_processed']} rows processed.")
+    print(f"{counters['date_cells_corrected']} cells in 'Quantity' column corrected from date format to numeric values.")
+    if counters['errors_encountered'] > 0:
+        print(f"{counters['errors_encountered']} errors encountered during processing.")
+    else:
+        print("No errors encountered during processing.")
 
-# ==================
-# PROCESS 'Quantity' COLUMN IN 'Supply Page' SHEET
-# ==================
+    # Record which export this folder's raw file was made from; step 7 marks it as built
+    record_raw_export(output_dir, export_state['sha256'])
+    return data
 
-# Check if 'Supply Page' sheet exists
-if 'Supply Page' in wb.sheetnames:
-    ws = wb['Supply Page']
-    print("Processing 'Supply Page' sheet to correct 'Quantity' column.")
-else:
-    print("Sheet 'Supply Page' not found. Exiting.")
-    exit(1)
-
-# Map header names to column letters
-header_row = ws[1]  # Assuming headers are in the first row
-header_map = {}  # Map from header name to column letter
-
-for cell in header_row:
-    header_map[cell.value] = cell.column_letter
-
-# Check if 'Quantity' column exists
-if 'Quantity' in header_map:
-    quantity_col_letter = header_map['Quantity']
-    quantity_col_index = openpyxl.utils.column_index_from_string(quantity_col_letter)
-    print(f"'Quantity' column found at column {quantity_col_letter}.")
-else:
-    print("Column 'Quantity' not found in 'Supply Page'. Exiting.")
-    exit(1)
-
-# Process each cell in the 'Quantity' column starting from row 2
-rows_processed = 0
-date_cells_corrected = 0
-errors_encountered = 0
-
-for row in ws.iter_rows(min_row=2):
-    cell = row[quantity_col_index - 1]  # zero-based index
-    rows_processed += 1
-
-    # Initialize quantity to None
-    quantity = None
+
+if __name__ == '__main__':
+    # Create a folder on the desktop with the format "UNRWA Truck Data_YYYYMMDD"
+    output_dir = get_data_dir()
 
     try:
-        if cell.value is None or cell.value == '':
-            quantity = 0  # Preserve legitimate zeros or empty cells
-        elif isinstance(cell.value, datetime):
-            # Cell is a datetime object, likely due to date formatting error
-            # Compute the date serial number
-            base_date = datetime(1899, 12, 31)
-            delta = cell.value - base_date
-            quantity = delta.days
-            date_cells_corrected += 1
-        elif isinstance(cell.value, (int, float)):
-            quantity = cell.value  # Cell contains a numeric value
-        else:
-            # Try to convert cell.value to float
-            quantity = float(cell.value)
-    except Exception as e:
-        print(f"Error processing cell {cell.coordinate}: {e}")
-        errors_encountered += 1
-        quantity = 0  # Default to zero or handle as needed
-
-    # Update the cell with the corrected quantity
-    cell.value = quantity
-    # Set the cell's number format to 'General' to avoid future misinterpretation
-    cell.number_format = 'General'
-
-# Save the changes to the file
-wb.save(output_file)
-print(f"Processing complete. {rows_processed} rows processed.")
-print(f"{date_cells_corrected} cells in 'Quantity' column corrected from date format to numeric values.")
-if errors_encountered > 0:
-    print(f"{errors_encountered} errors encountered during processing.")
-else:
-    print("No errors encountered during processing.")
+        data = run(output_dir)
+    except DownloadError as e:
+        print(f"Failed to download file. {e}")
+        exit(1)
+    except KeyError as e:
+        print(f"{e.args[0]} Exiting.")
+        exit(1)
+    if data is None:
+        exit(EXIT_UNCHANGED)
+
+    # Save the corrected sheet to the intermediate store for step 2
+    save_table(data, output_dir, 'unrwa_raw')
@@ -1,99 +1,101 @@
 import pandas as pd
 import numpy as np
-import os
-import shutil
-from datetime import datetime
-import platform
+import classification
+import compact
+import history
+import incremental
+import item_table
+from archive import archive_table
+from store import get_data_dir, get_run_date, load_table, save_table
 
 # =====================
 # STEP 4: CALCULATE TRUCK KCALS & METRIC TONS
 # =====================
 
-# Get the current date in the format YYYYMMDD
-current_date = datetime.now().strftime('%Y%m%d')
+# Add truck types, sectors, cargo types and metric tons to the trucks and items from step 3
+def run(data, items, data_dir):
+    # Work on a copy so the table passed in is left as it was
+    data = data.copy()
 
-# Determine the user's desktop location
-if platform.system() == "Darwin":  # macOS
-    desktop = os.path.join(os.path.expanduser("~"), "Desktop")
-elif platform.system() == "Windows":  # Windows
-    desktop = os.path.join(os.path.expanduser("~"), "Desktop")
-else:
-    raise Exception("Unsupported operating system. This script works on macOS and Windows only.")
+    # In incremental mode, only recompute the rows step 2 queued for this step
+    incremental_run = incremental.is_enabled()
+    if incremental_run:
+        state_dir = incremental.get_state_dir()
+        input_ids = data['ID']
+        data, previous_result, pending_ids = incremental.select_pending_rows(data, state_dir, 'unrwa_trucks_kcal_mt')
+        print(f"Incremental mode: recomputing {len(data)} of {len(input_ids)} rows.")
 
-# Path to the folder created by previous steps
-folder_name = f"UNRWA Truck Data_{current_date}"
-data_dir = os.path.join(desktop, folder_name)
+    # Position of each item's truck in data
+    rows = item_table.truck_rows(data, items)
 
-# Input file path (output from Step 3)
-data_path = os.path.join(data_dir, "unrwa_trucks.xlsx")
+    # =====================
+    # Add food item counts and truck types to the data
+    # =====================
+    # Count number of food items (items with kcal > 0)
+    data['food_item_count'] = item_table.count_per_truck(data, items, mask=items['kcal'].gt(0), rows=rows)
 
-# Load the data from the 'unrwa_trucks_kcal' sheet
-data = pd.read_excel(data_path, sheet_name='unrwa_trucks_kcal')
+    # Count total number of items
+    data['item_count'] = item_table.count_per_truck(data, items, rows=rows)
 
-# Identify item columns, kg columns, and kcal columns
-item_columns = [col for col in data.columns if col.startswith('item_') and not col.endswith(('_kg', '_kcal', '_matched'))]
-kg_columns = [f'{col}_kg' for col in item_columns]
-kcal_columns = [f'{col}_kcal' for col in item_columns]
+    # Truck type, sector and cargo type from the rule tables in classification.py
+    data = classification.classify_trucks(data)
 
-# =====================
-# Add food item counts and truck types to the data
-# =====================
-# Count number of food items (items with kcal > 0)
-data['food_item_count'] = data[kcal_columns].gt(0).sum(axis=1)
-
-# Count total number of items
-data['item_count'] = data[item_columns].notna().sum(axis=1)
-
-# Determine truck type based on food item count
-def determine_truck_type(row):
-    if row['food_item_count'] > 0 and row['food_item_count'] == row['item_count']:
-        return 'Food Truck'
-    elif row['food_item_count'] == 0:
-        return 'Non-Food Truck'
-    else:
-        return 'Mixed Food/Non-Food Truck'
-
-data['truck_type'] = data.apply(determine_truck_type, axis=1)
-
-# Determine sector based on 'Donation Type'
-def determine_sector(donation_type):
-    if pd.isna(donation_type):
-        return 'unknown'
-    donation_type_lower = str(donation_type).lower()
-    if 'private sector' in donation_type_lower:
-        return 'private'
-    elif 'humanitarian' in donation_type_lower:
-        return 'humanitarian'
-    else:
-        return 'unknown'
-
-data['sector'] = data['Donation Type'].apply(determine_sector)
+    # =====================
+    # Additional calculations
+    # =====================
+    # Calculate truck food weight in metric tons
+    data['truck_food_mt'] = data['truck_weight_kg'] / 1000
 
-# =====================
-# Additional calculations
-# =====================
-# Calculate truck food weight in metric tons
-data['truck_food_mt'] = data['truck_weight_kg'] / 1000
+    # Calculate truck food ratio
+    data['truck_food_ratio'] = data['truck_food_mt'] / (data['truck_weight_kg'] / 1000)
+    data['truck_food_ratio'].fillna(0, inplace=True)
 
-# Calculate truck food ratio
-data['truck_food_ratio'] = data['truck_food_mt'] / (data['truck_weight_kg'] / 1000)
-data['truck_food_ratio'].fillna(0, inplace=True)
+    # Replace infinite values with zero
+    data['truck_food_ratio'].replace([np.inf, -np.inf], 0, inplace=True)
 
-# Replace infinite values with zero
-data['truck_food_ratio'].replace([np.inf, -np.inf], 0, inplace=True)
+    # Merge the recomputed rows into the results of the last incremental run
+    if incremental_run:
+        data = incremental.finish_row_stage(data, previous_result, pending_ids, input_ids, state_dir, 'unrwa_trucks_kcal_mt')
 
-# =====================
-# Save the updated data with the original sheet name
-# =====================
-output_file = os.path.join(data_dir, "unrwa_trucks.xlsx")
-with pd.ExcelWriter(output_file, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-    data.to_excel(writer, sheet_name='unrwa_trucks_kcal_mt', index=False)
-
-# Archive the workbook
-archive_dir = os.path.join(data_dir, "archive")
-os.makedirs(archive_dir, exist_ok=True)
-timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-archive_file_path = os.path.join(archive_dir, f'unrwa_trucks_{timestamp}.xlsx')
-shutil.copy(output_file, archive_file_path)
-
-print(f'Processing and saving completed. Archived as {archive_file_path}.')
+    # In compact mode, keep the new columns compact too
+    if compact.is_enabled():
+        data = compact.compact_table(data)
+
+    if history.is_enabled():
+        update_history(data, items, data_dir)
+
+    return data
+
+
+# Keep the month-partitioned history of the trucks and their items up to date,
+# with each item dated by its truck
+def update_history(data, items, data_dir):
+    run_date = get_run_date(data_dir)
+    history.write_history('trucks', data, run_date)
+    truck_dates = pd.to_datetime(data['date'], errors='coerce').to_numpy()
+    item_rows = item_table.truck_rows(data, items)
+    item_dates = np.where(item_rows >= 0, truck_dates[np.maximum(item_rows, 0)], np.datetime64('NaT'))
+    history.write_history('items', items.assign(date=item_dates), run_date)
+
+
+# Called instead of run() when the stage cache (see stage_cache.py) has its result,
+# as the history may have changed since that result was cached
+def replay(data, items, result, data_dir):
+    if history.is_enabled():
+        update_history(result, items, data_dir)
+
+
+if __name__ == '__main__':
+    # Path to the folder created by previous steps
+    data_dir = get_data_dir()
+
+    # Load the trucks from the 'unrwa_trucks_kcal' table and their items' kcals
+    data = run(load_table(data_dir, 'unrwa_trucks_kcal'), load_table(data_dir, 'unrwa_items_kcal'), data_dir)
+
+    # =====================
+    # Save the updated data to the intermediate store and archive it
+    # =====================
+    save_table(data, data_dir, 'unrwa_trucks_kcal_mt')
+    archive_file_path = archive_table(data_dir, 'unrwa_trucks_kcal_mt')
+
+    print(f'Processing and saving completed. Archived as {archive_file_path}.')
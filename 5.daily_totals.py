@@ -1,122 +1,139 @@
+import argparse
 import os
 import pandas as pd
 import numpy as np
-from datetime import datetime
-import openpyxl
-import platform
+import classification
+import daily_cube
+import history
+import incremental
+from store import get_data_dir, load_table, save_table
 
 # =====================
 # STEP 5: DAILY SUMMARY CALCULATIONS
 # =====================
 
-# Get the current date in the format YYYYMMDD (to match the folder created in steps 1-4)
-current_date = datetime.now().strftime('%Y%m%d')
-
-# Determine the user's desktop location (macOS and Windows compatibility)
-if platform.system() == "Darwin":  # macOS
-    desktop = os.path.join(os.path.expanduser("~"), "Desktop")
-elif platform.system() == "Windows":  # Windows
-    desktop = os.path.join(os.path.expanduser("~"), "Desktop")
-else:
-    raise Exception("Unsupported operating system. This script works on macOS and Windows only.")
-
-# Path to the folder created by previous steps (same date-based folder)
-folder_name = f"UNRWA Truck Data_{current_date}"
-data_dir = os.path.join(desktop, folder_name)
-
-# File path (input from step 4)
-file_path = os.path.join(data_dir, "unrwa_trucks.xlsx")
-
-# Load the data from the 'unrwa_trucks_kcal_mt' sheet generated by Script 4
-data = pd.read_excel(file_path, sheet_name='unrwa_trucks_kcal_mt')
-
-# Check for necessary columns
-required_columns = ['date', 'truck_kcal', 'truck_type', 'sector', 'truck_food_mt', 'truck_weight_kg', 'ID']
-for col in required_columns:
-    if col not in data.columns:
-        raise KeyError(f"The required column '{col}' does not exist in the dataset. Please check the data or previous processing steps.")
-
-# Ensure 'date' column is of datetime type and extract date
-data['date'] = pd.to_datetime(data['date']).dt.date
-
-# Group data by date and compute sums and counts
-data_daily = data.groupby('date').agg(
-    total_trucks=('ID', 'count'),
-    daily_kcal=('truck_kcal', 'sum'),
-    daily_food_mt=('truck_food_mt', 'sum'),
-    daily_mt_kg=('truck_weight_kg', 'sum')
-).reset_index()
-
-# Convert 'daily_mt_kg' from kg to metric tons
-data_daily['daily_mt'] = data_daily['daily_mt_kg'] / 1000
-
-# Drop 'daily_mt_kg' as it's no longer needed
-data_daily.drop(columns='daily_mt_kg', inplace=True)
-
-# Compute counts of trucks per truck_type
-truck_type_counts = data.pivot_table(index='date', columns='truck_type', values='ID', aggfunc='count', fill_value=0)
-truck_type_counts = truck_type_counts.rename(columns={
-    'Food Truck': 'count_daily_truck_food',
-    'Non-Food Truck': 'count_daily_truck_nonfood',
-    'Mixed Food/Non-Food Truck': 'count_daily_truck_mixed'
-}).reset_index()
-
-# Merge truck type counts into data_daily
-data_daily = pd.merge(data_daily, truck_type_counts, on='date', how='left')
-
-# Compute counts of trucks per sector
-sector_counts = data.pivot_table(index='date', columns='sector', values='ID', aggfunc='count', fill_value=0)
-sector_counts = sector_counts.rename(columns={
-    'humanitarian': 'count_daily_sector_humanitarian',
-    'private': 'count_daily_sector_private',
-    'unknown': 'count_daily_sector_unknown'
-}).reset_index()
-
-# Merge sector counts into data_daily
-data_daily = pd.merge(data_daily, sector_counts, on='date', how='left')
-
-# If 'Crossing' column exists, compute counts per crossing
-if 'Crossing' in data.columns:
-    crossing_counts = data.pivot_table(index='date', columns='Crossing', values='ID', aggfunc='count', fill_value=0)
-    # Rename columns to meaningful names
-    crossing_counts.columns = [f'entry_{col.lower()}_count' for col in crossing_counts.columns]
-    crossing_counts = crossing_counts.reset_index()
-    # Merge with data_daily
-    data_daily = pd.merge(data_daily, crossing_counts, on='date', how='left')
-else:
-    print("Warning: The 'Crossing' column does not exist in the dataset. Skipping crossing-related calculations.")
-
-# Classify cargo types based on 'truck_type'
-def classify_cargo(truck_type):
-    if truck_type == 'Food Truck':
-        return 'food'
-    elif truck_type == 'Non-Food Truck':
-        return 'nonfood'
-    elif truck_type == 'Mixed Food/Non-Food Truck':
-        return 'mixed'
+# Columns of the 'unrwa_trucks_kcal_mt' table generated by Script 4 that this step uses
+input_columns = ['date', 'truck_kcal', 'truck_type', 'sector', 'cargo_type', 'truck_food_mt', 'truck_weight_kg', 'ID', 'Crossing']
+
+
+# Compute the daily cube and the daily totals from the output of step 4
+def run(data, data_dir):
+    # Only keep the needed columns, as a copy so the table passed in is left as it was
+    data = data[[col for col in input_columns if col in data.columns]].copy()
+
+    # Check for necessary columns
+    required_columns = ['date', 'truck_kcal', 'truck_type', 'sector', 'truck_food_mt', 'truck_weight_kg', 'ID']
+    for col in required_columns:
+        if col not in data.columns:
+            raise KeyError(f"The required column '{col}' does not exist in the dataset. Please check the data or previous processing steps.")
+
+    # Cargo types are set by step 4; tables saved before it did are classified here
+    if 'cargo_type' not in data.columns:
+        data['cargo_type'] = classification.classify_cargo_type(data['truck_type'])
+
+    # In incremental mode, only re-aggregate the dates step 2 queued for this step
+    incremental_run = incremental.is_enabled()
+    if incremental_run:
+        state_dir = incremental.get_state_dir()
+        full, pending_dates = incremental.get_pending(state_dir, 'unrwa_daily_entries')
+        previous_cube = None if full else incremental.load_state_table(state_dir, 'unrwa_daily_cube')
+        if previous_cube is not None:
+            data = data[pd.to_datetime(data['date']).dt.normalize().isin(pd.to_datetime(sorted(pending_dates)))]
+            print(f"Incremental mode: recomputing {len(pending_dates)} dates.")
+
+    # Ensure 'date' column is of datetime type and extract date
+    data['date'] = pd.to_datetime(data['date']).dt.date
+
+    # Aggregate the trucks once into the daily cube
+    cube = daily_cube.build_cube(data)
+
+    # Merge the recomputed dates into the cube of the last incremental run
+    if incremental_run:
+        cube = incremental.merge_by_period(previous_cube, cube, pending_dates, 'date',
+                                           lambda dates: pd.to_datetime(dates).dt.strftime('%Y-%m-%d'))
+
+    # Daily sums and counts from the cube
+    totals = daily_cube.daily_totals(cube)
+    data_daily = pd.DataFrame({
+        'total_trucks': totals['trucks'],
+        'daily_kcal': totals['kcal'],
+        'daily_food_mt': totals['food_mt'],
+        # Convert the weight from kg to metric tons
+        'daily_mt': totals['weight_kg'] / 1000,
+    })
+
+    # Counts of trucks per truck_type, sector, crossing and cargo type
+    truck_type_counts = daily_cube.count_by(cube, 'truck_type').rename(columns={
+        'Food Truck': 'count_daily_truck_food',
+        'Non-Food Truck': 'count_daily_truck_nonfood',
+        'Mixed Food/Non-Food Truck': 'count_daily_truck_mixed'
+    })
+    sector_counts = daily_cube.count_by(cube, 'sector').rename(columns={
+        'humanitarian': 'count_daily_sector_humanitarian',
+        'private': 'count_daily_sector_private',
+        'unknown': 'count_daily_sector_unknown'
+    })
+    counts = [truck_type_counts, sector_counts]
+
+    # If 'Crossing' column exists, compute counts per crossing
+    if 'Crossing' in cube.columns:
+        crossing_counts = daily_cube.count_by(cube, 'Crossing')
+        # Rename columns to meaningful names
+        crossing_counts.columns = [f'entry_{col.lower()}_count' for col in crossing_counts.columns]
+        counts.append(crossing_counts)
     else:
-        return 'unknown'
-
-data['cargo_type'] = data['truck_type'].apply(classify_cargo)
-
-# Compute counts of cargo types per day
-cargo_type_counts = data.pivot_table(index='date', columns='cargo_type', values='ID', aggfunc='count', fill_value=0)
-cargo_type_counts = cargo_type_counts.rename(columns={
-    'food': 'cargo_type_food_count',
-    'nonfood': 'cargo_type_nonfood_count',
-    'mixed': 'cargo_type_mixed_count',
-    'unknown': 'cargo_type_unknown_count'
-}).reset_index()
-
-# Merge cargo type counts into data_daily
-data_daily = pd.merge(data_daily, cargo_type_counts, on='date', how='left')
-
-# Fill NaN values with zeros in count columns
-count_columns = [col for col in data_daily.columns if 'count' in col]
-data_daily[count_columns] = data_daily[count_columns].fillna(0).astype(int)
+        print("Warning: The 'Crossing' column does not exist in the dataset. Skipping crossing-related calculations.")
+
+    cargo_type_counts = daily_cube.count_by(cube, 'cargo_type').rename(columns={
+        'food': 'cargo_type_food_count',
+        'nonfood': 'cargo_type_nonfood_count',
+        'mixed': 'cargo_type_mixed_count',
+        'unknown': 'cargo_type_unknown_count'
+    })
+    counts.append(cargo_type_counts)
+
+    # Line the counts up with the daily totals by date (with plain column names, as
+    # pivots of categorical columns have a categorical column index)
+    for count_table in counts:
+        count_table.columns = list(count_table.columns)
+    data_daily = pd.concat([data_daily] + [count_table.reindex(data_daily.index) for count_table in counts], axis=1)
+    data_daily = data_daily.rename_axis('date').reset_index()
+
+    # Fill NaN values with zeros in count columns
+    count_columns = [col for col in data_daily.columns if 'count' in col]
+    data_daily[count_columns] = data_daily[count_columns].fillna(0).astype(int)
+
+    if incremental_run:
+        save_table(cube, state_dir, 'unrwa_daily_cube')
+        incremental.clear_pending(state_dir, 'unrwa_daily_entries')
+
+    return data_daily, cube
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compute the daily totals, or a report of them for a slice of the truck history.")
+    history.add_query_arguments(parser)
+    args = parser.parse_args()
+
+    # Path to the folder created by previous steps (same date-based folder)
+    data_dir = get_data_dir()
+
+    if history.is_query(args):
+        # Ad-hoc report on the trucks of the history matching the query; the store and
+        # the incremental state are left as they are
+        os.environ.pop(incremental.INCREMENTAL_ENV, None)
+        trucks = history.query('trucks', args.start, args.end, columns=input_columns, filters=history.query_filters(args))
+        data_daily, cube = run(trucks, data_dir)
+        report_path = history.query_report_path(data_dir, 'daily_entries', args)
+        os.makedirs(os.path.dirname(report_path), exist_ok=True)
+        data_daily.to_csv(report_path, index=False)
+        print(f"Daily totals of {len(trucks)} trucks saved to '{report_path}'.")
+    else:
+        # Load only the needed columns of the 'unrwa_trucks_kcal_mt' table generated by Script 4
+        data_daily, cube = run(load_table(data_dir, 'unrwa_trucks_kcal_mt', columns=input_columns), data_dir)
 
-# Save `data_daily` with all columns in `unrwa_trucks.xlsx` as a new sheet `unrwa_daily_entries`
-with pd.ExcelWriter(file_path, mode='a', engine='openpyxl', if_sheet_exists='replace') as writer:
-    data_daily.to_excel(writer, sheet_name='unrwa_daily_entries', index=False)
+        # Save `data_daily` with all columns to the intermediate store as `unrwa_daily_entries`
+        save_table(data_daily, data_dir, 'unrwa_daily_entries')
+        save_table(cube, data_dir, 'unrwa_daily_cube')
 
-print("Processing complete and data saved to 'unrwa_daily_entries' sheet.")
+        print("Processing complete and data saved to 'unrwa_daily_entries' and 'unrwa_daily_cube' tables.")
@@ -1,68 +1,93 @@
+import argparse
 import os
 import pandas as pd
-import numpy as np
-from datetime import datetime
-import platform
+import daily_cube
+import history
+import incremental
+import rollups
+from store import get_data_dir, load_table, save_table
 
 # =====================
-# STEP 6: MONTHLY HUMANITARIAN FOOD MT BY ENTRY
+# STEP 6: WEEKLY/MONTHLY ROLLUPS AND MONTHLY HUMANITARIAN FOOD MT BY ENTRY
 # =====================
 
-# Get the current date in the format YYYYMMDD (to match the folder created in previous steps)
-current_date = datetime.now().strftime('%Y%m%d')
-
-# Determine the user's desktop location (macOS and Windows compatibility)
-if platform.system() == "Darwin":  # macOS
-    desktop = os.path.join(os.path.expanduser("~"), "Desktop")
-elif platform.system() == "Windows":  # Windows
-    desktop = os.path.join(os.path.expanduser("~"), "Desktop")
-else:
-    raise Exception("Unsupported operating system. This script works on macOS and Windows only.")
-
-# Path to the folder created by previous steps (same date-based folder)
-folder_name = f"UNRWA Truck Data_{current_date}"
-data_dir = os.path.join(desktop, folder_name)
-
-# File path (input from step 4)
-file_path = os.path.join(data_dir, "unrwa_trucks.xlsx")
-
-# Load the data from the 'unrwa_trucks_kcal_mt' sheet generated by Script 4
-data = pd.read_excel(file_path, sheet_name='unrwa_trucks_kcal_mt')
-
-# Check for necessary columns
-required_columns = ['date', 'sector', 'truck_food_mt', 'Crossing']
-for col in required_columns:
-    if col not in data.columns:
-        raise KeyError(f"The required column '{col}' does not exist in the dataset. Please check the data or previous processing steps.")
-
-# Ensure 'date' column is of datetime type and extract month
-data['date'] = pd.to_datetime(data['date'])
-data['Month'] = data['date'].dt.to_period('M')
-
-# Filter data for 'humanitarian' sector and truck_food_mt > 0
-humanitarian_food_data = data[(data['sector'] == 'humanitarian') & (data['truck_food_mt'] > 0)]
-
-# Group the data by 'Month' and 'Crossing', summing up 'truck_food_mt'
-monthly_entry_totals = humanitarian_food_data.groupby(['Month', 'Crossing']).agg(
-    monthly_food_mt=('truck_food_mt', 'sum')
-).reset_index()
-
-# Pivot the table so that each 'Crossing' value becomes a column
-monthly_entry_pivot = monthly_entry_totals.pivot(index='Month', columns='Crossing', values='monthly_food_mt')
-
-# Replace NaN values with zeros
-monthly_entry_pivot = monthly_entry_pivot.fillna(0)
-
-# Reset index to turn 'Month' into a column
-monthly_entry_pivot = monthly_entry_pivot.reset_index()
-
-# Optionally, you can rename the columns to make them more descriptive
-monthly_entry_pivot.rename(columns={'Month': 'month'}, inplace=True)
-monthly_entry_pivot.columns.name = None  # Remove the name 'Crossing' from columns
-
-# Save the resulting table to a new sheet named 'monthly_hfa' in the existing Excel file
-output_sheet_name = 'monthly_hfa'
-with pd.ExcelWriter(file_path, mode='a', engine='openpyxl', if_sheet_exists='replace') as writer:
-    monthly_entry_pivot.to_excel(writer, sheet_name=output_sheet_name, index=False)
-
-print(f"Monthly humanitarian food MT by entry point saved to '{output_sheet_name}' sheet in '{file_path}'.")
\ No newline at end of file
+# Columns of the 'unrwa_daily_cube' table generated by Script 5 that this step requires
+required_columns = ['date', 'sector', 'food_mt', 'Crossing']
+
+
+# Compute the weekly and monthly rollups of the daily cube from step 5, and the
+# monthly humanitarian food MT per entry point from the monthly rollup
+def run(cube, data_dir):
+    # Check for necessary columns
+    for col in required_columns:
+        if col not in cube.columns:
+            raise KeyError(f"The required column '{col}' does not exist in the dataset. Please check the data or previous processing steps.")
+
+    # In incremental mode, only re-aggregate the weeks and months of the dates step 2 queued for this step
+    incremental_run = incremental.is_enabled()
+    previous_weekly = previous_monthly = None
+    if incremental_run:
+        state_dir = incremental.get_state_dir()
+        full, pending_dates = incremental.get_pending(state_dir, 'monthly_hfa')
+        if not full:
+            previous_weekly = incremental.load_state_table(state_dir, 'unrwa_weekly_rollup')
+            previous_monthly = incremental.load_state_table(state_dir, 'unrwa_monthly_rollup')
+        if previous_weekly is None or previous_monthly is None:
+            previous_weekly = previous_monthly = None
+        else:
+            print(f"Incremental mode: recomputing the weeks and months of {len(pending_dates)} dates.")
+
+    if previous_monthly is not None:
+        weekly = rollups.update_rollup(previous_weekly, cube, pending_dates, 'week')
+        monthly = rollups.update_rollup(previous_monthly, cube, pending_dates, 'month')
+    else:
+        weekly = rollups.build_rollup(cube, 'week')
+        monthly = rollups.build_rollup(cube, 'month')
+
+    # Humanitarian food MT per month, with each 'Crossing' value as a column
+    food_cells = monthly[monthly['food_mt'] > 0]
+    monthly_entry_pivot = rollups.project(food_cells, 'month', 'food_mt', 'Crossing', filters={'sector': 'humanitarian'})
+
+    # Reset index to turn 'month' into a column
+    monthly_entry_pivot = monthly_entry_pivot.reset_index()
+
+    if incremental_run:
+        save_table(weekly, state_dir, 'unrwa_weekly_rollup')
+        save_table(monthly, state_dir, 'unrwa_monthly_rollup')
+        incremental.clear_pending(state_dir, 'monthly_hfa')
+
+    return monthly_entry_pivot, weekly, monthly
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compute the rollups and monthly humanitarian food MT, or a report of them for a slice of the truck history.")
+    history.add_query_arguments(parser)
+    args = parser.parse_args()
+
+    # Path to the folder created by previous steps (same date-based folder)
+    data_dir = get_data_dir()
+
+    if history.is_query(args):
+        # Ad-hoc report on the trucks of the history matching the query; the store and
+        # the incremental state are left as they are
+        os.environ.pop(incremental.INCREMENTAL_ENV, None)
+        trucks = history.query('trucks', args.start, args.end, columns=daily_cube.CUBE_INPUT_COLUMNS,
+                               filters=history.query_filters(args))
+        trucks['date'] = pd.to_datetime(trucks['date']).dt.date
+        monthly_entry_pivot, weekly, monthly = run(daily_cube.build_cube(trucks), data_dir)
+        report_path = history.query_report_path(data_dir, 'monthly_hfa', args)
+        os.makedirs(os.path.dirname(report_path), exist_ok=True)
+        monthly_entry_pivot.to_csv(report_path, index=False)
+        print(f"Monthly humanitarian food MT of {len(trucks)} trucks saved to '{report_path}'.")
+    else:
+        # Load the 'unrwa_daily_cube' table generated by Script 5
+        monthly_entry_pivot, weekly, monthly = run(load_table(data_dir, 'unrwa_daily_cube'), data_dir)
+
+        # Save the resulting tables to the intermediate store
+        output_table_name = 'monthly_hfa'
+        output_path = save_table(monthly_entry_pivot, data_dir, output_table_name)
+        save_table(weekly, data_dir, 'unrwa_weekly_rollup')
+        save_table(monthly, data_dir, 'unrwa_monthly_rollup')
+
+        print(f"Monthly humanitarian food MT by entry point saved to '{output_table_name}' table in '{output_path}'.")
+        print("Weekly and monthly rollups saved to 'unrwa_weekly_rollup' and 'unrwa_monthly_rollup' tables.")
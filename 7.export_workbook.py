@@ -0,0 +1,173 @@
+import math
+import os
+from datetime import date, datetime
+import xlsxwriter
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_numeric_dtype
+import compact
+import item_table
+from archive import archive_file
+from profiling import count_file_bytes
+from store import EXPORT_SHEETS_ENV, WORKBOOK_SHEETS, get_data_dir, get_run_date, load_table, table_exists
+from supply_page import mark_export_built
+
+# =====================
+# STEP 7: EXPORT WORKBOOK
+# =====================
+# The workbook is written once per run, in one pass, with xlsxwriter in
+# constant-memory mode: each row is flushed to disk as soon as it is written, so
+# memory doesn't grow with the size of the workbook. Sheets are built one at a
+# time and dropped once written. Set UNRWA_EXPORT_SHEETS to a comma-separated
+# list of tables (or pass --sheets to 0.master_script.py) to export only some sheets.
+
+# Excel's row limit, header included
+MAX_EXCEL_ROWS = 1048576
+
+# Rows converted to Python values at a time, so memory doesn't grow with the sheet
+WRITE_SLICE_ROWS = 20000
+
+
+# Sheets to export: from UNRWA_EXPORT_SHEETS if set, otherwise all of them
+def get_export_sheets():
+    value = os.environ.get(EXPORT_SHEETS_ENV, '').strip()
+    if not value:
+        return list(WORKBOOK_SHEETS)
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+# Write function for the cells of a column, picked once from its dtype.
+# Cell formats follow pandas' to_excel: dates as YYYY-MM-DD, timestamps with the time.
+def _cell_writer(worksheet, values, formats):
+    if is_bool_dtype(values.dtype):
+        return worksheet.write_boolean
+    if is_numeric_dtype(values.dtype):
+        return lambda row, col, value: _write_number(worksheet, row, col, value)
+    if is_datetime64_any_dtype(values.dtype):
+        return lambda row, col, value: worksheet.write_datetime(row, col, value, formats['datetime'])
+    return lambda row, col, value: _write_any(worksheet, row, col, value, formats)
+
+
+def _write_number(worksheet, row, col, value):
+    if math.isinf(value):
+        worksheet.write_string(row, col, 'inf' if value > 0 else '-inf')
+    else:
+        worksheet.write_number(row, col, value)
+
+
+# Cells of text columns, which can also hold numbers, dates, periods and other objects
+def _write_any(worksheet, row, col, value, formats):
+    if isinstance(value, str):
+        worksheet.write_string(row, col, value)
+    elif isinstance(value, bool):
+        worksheet.write_boolean(row, col, value)
+    elif isinstance(value, (int, float)):
+        _write_number(worksheet, row, col, value)
+    elif isinstance(value, datetime):
+        worksheet.write_datetime(row, col, value, formats['datetime'])
+    elif isinstance(value, date):
+        worksheet.write_datetime(row, col, value, formats['date'])
+    else:
+        worksheet.write_string(row, col, str(value))
+
+
+# Stream one table into a new sheet, row by row as constant-memory mode requires
+def write_sheet(workbook, sheet_name, data, formats):
+    if len(data) + 1 > MAX_EXCEL_ROWS:
+        raise ValueError(f"Table '{sheet_name}' has {len(data)} rows, more than an Excel sheet can hold.")
+    worksheet = workbook.add_worksheet(sheet_name)
+    for col, name in enumerate(data.columns):
+        worksheet.write_string(0, col, str(name), formats['header'])
+
+    writers = [_cell_writer(worksheet, data[name], formats) for name in data.columns]
+    for start in range(0, len(data), WRITE_SLICE_ROWS):
+        rows = data.iloc[start:start + WRITE_SLICE_ROWS]
+        # Plain Python values, with None for missing cells, which are left empty
+        columns = [values.astype(object).where(values.notna(), None).tolist() for _, values in rows.items()]
+        for row, cells in enumerate(zip(*columns), start=start + 1):
+            for col, value in enumerate(cells):
+                if value is not None:
+                    writers[col](row, col, value)
+        del columns
+
+
+# Write every table produced by steps 2-6 (or only those in sheets) as a sheet of the
+# final workbook in one go. Tables already in memory can be passed in tables; the others
+# are read from the store.
+def run(data_dir, tables=None, sheets=None):
+    tables = dict(tables or {})
+    sheets = get_export_sheets() if sheets is None else list(sheets)
+    unknown = [name for name in sheets if name not in WORKBOOK_SHEETS]
+    if unknown:
+        raise ValueError(f"Unknown workbook sheets {unknown}. Choose from {WORKBOOK_SHEETS}.")
+
+    # Output workbook
+    output_file = os.path.join(data_dir, "unrwa_trucks.xlsx")
+
+    # Every table the sheets need (and the item tables of truck sheets) has to be in memory or
+    # in the store. Otherwise nothing is written, and the last workbook is left as it was.
+    sheets = [name for name in WORKBOOK_SHEETS if name in sheets]
+    needed = sheets + [item_table.SHEET_ITEMS[name] for name in sheets if name in item_table.SHEET_ITEMS]
+    missing = [name for name in dict.fromkeys(needed) if name not in tables and not table_exists(data_dir, name)]
+    if missing:
+        raise FileNotFoundError(f"Tables {missing} were not produced in this run and are not in the store. "
+                                f"Run the steps that make them first, with --checkpoint to keep them for later runs.")
+
+    # Get a table from memory or from the store.
+    # Tables read from the store are only kept when keep is set (item tables shared by sheets).
+    def get_table(name, keep=False):
+        if name in tables:
+            return tables[name]
+        table = load_table(data_dir, name)
+        if keep:
+            tables[name] = table
+        return table
+
+    # Write to a temporary file and swap it in, so a failed export leaves the last workbook as it was
+    tmp_file = f"{output_file}.tmp"
+    workbook = xlsxwriter.Workbook(tmp_file, {'constant_memory': True})
+    # A fixed creation time (the run's date) keeps the file identical when the data is, so the
+    # archive store (see archive.py) keeps one copy of workbooks exported more than once
+    run_date = get_run_date(data_dir)
+    if run_date is not None:
+        workbook.set_properties({'created': datetime.strptime(run_date, '%Y%m%d')})
+    formats = {
+        'header': workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}),
+        'date': workbook.add_format({'num_format': 'YYYY-MM-DD'}),
+        'datetime': workbook.add_format({'num_format': 'YYYY-MM-DD HH:MM:SS'}),
+    }
+    try:
+        for sheet_name in sheets:
+            data = get_table(sheet_name)
+            # Truck sheets get their items back as item_N columns
+            if sheet_name in item_table.SHEET_ITEMS:
+                data = item_table.widen(data, get_table(item_table.SHEET_ITEMS[sheet_name], keep=True))
+            data = compact.expand_floats(data)
+            write_sheet(workbook, sheet_name, data, formats)
+            print(f"Sheet '{sheet_name}' written ({len(data)} rows).")
+            del data
+        workbook.close()
+    except Exception:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    # Archive the workbook of the last run before the new one replaces it
+    if os.path.exists(output_file):
+        archive_file(data_dir, output_file, "unrwa_trucks.xlsx")
+    os.replace(tmp_file, output_file)
+    # The folder is now built from the export step 1 downloaded
+    mark_export_built(data_dir)
+
+    count_file_bytes('bytes_written', output_file)
+    return output_file
+
+
+if __name__ == '__main__':
+    # Path to the folder created by previous steps (same date-based folder)
+    data_dir = get_data_dir()
+
+    try:
+        output_file = run(data_dir)
+    except FileNotFoundError as e:
+        print(f"{e} Exiting.")
+        exit(1)
+
+    print(f"Workbook exported to {output_file}.")
@@ -0,0 +1,150 @@
+import argparse
+import gzip
+import json
+import os
+import shutil
+from datetime import datetime
+import pandas as pd
+import pyarrow.parquet as pq
+from profiling import count
+from store import file_digest, get_cache_dir, get_data_dir, table_path, write_parquet
+
+# =====================
+# ARCHIVE STORE
+# =====================
+# Snapshots of the tables of steps 3 and 4, taken on every run, and of the
+# previous workbook (step 7) go to one content-addressed archive in UNRWA Truck Data_cache/archive,
+# shared by all dated folders. Each file is stored once under the SHA-256 of its
+# contents: tables re-compressed as zstd Parquet, other files gzipped. A snapshot
+# is a line in index.jsonl that points at the object of that content, so
+# archiving a table that hasn't changed since the last run only adds an index
+# line. Any snapshot can be loaded or restored by name, run folder and time.
+
+ARCHIVE_DIRNAME = 'archive'
+INDEX_FILE = 'index.jsonl'
+
+# Object file extension per kind of snapshot
+OBJECT_EXTENSIONS = {'table': '.parquet', 'file': '.gz'}
+
+
+def get_archive_dir():
+    return os.path.join(get_cache_dir(), ARCHIVE_DIRNAME)
+
+
+def object_path(archive_dir, digest, kind):
+    return os.path.join(archive_dir, 'objects', digest[:2], f"{digest}{OBJECT_EXTENSIONS[kind]}")
+
+
+# Store the compressed contents of path under digest unless an object already has them.
+# Returns True if a new object was written.
+def _store_object(archive_dir, path, digest, kind):
+    target = object_path(archive_dir, digest, kind)
+    if os.path.exists(target):
+        count('archive_dedup_hits')
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Per-process temporary name, as backfill workers can archive the same content at once
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    if kind == 'table':
+        pq.write_table(pq.read_table(path), tmp_path, compression='zstd')
+    else:
+        with open(path, 'rb') as source, gzip.open(tmp_path, 'wb') as f:
+            shutil.copyfileobj(source, f)
+    os.replace(tmp_path, target)
+    count('archive_bytes_stored', os.path.getsize(target))
+    return True
+
+
+# Archive the file at path as a snapshot called name of the run in data_dir
+def archive_file(data_dir, path, name, kind='file'):
+    archive_dir = get_archive_dir()
+    os.makedirs(archive_dir, exist_ok=True)
+    digest = file_digest(path).hexdigest()
+    new_object = _store_object(archive_dir, path, digest, kind)
+    entry = {
+        'archived': datetime.now().isoformat(timespec='seconds'),
+        'run': os.path.basename(os.path.normpath(data_dir)),
+        'name': name,
+        'kind': kind,
+        'hash': digest,
+        'bytes': os.path.getsize(path),
+        'new_object': new_object,
+    }
+    with open(os.path.join(archive_dir, INDEX_FILE), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, sort_keys=True) + "\n")
+    return object_path(archive_dir, digest, kind)
+
+
+# Archive a stored table of data_dir; returns the path of its archive object
+def archive_table(data_dir, name):
+    return archive_file(data_dir, table_path(data_dir, name), name, kind='table')
+
+
+# Archive a table held in memory (not checkpointed to the store); returns the path
+# of its archive object. It is written as the store would write it, so a table that
+# was also checkpointed by another run shares its object.
+def archive_frame(data_dir, table, name):
+    archive_dir = get_archive_dir()
+    tmp_path = write_parquet(table, os.path.join(archive_dir, f"{name}.{os.getpid()}.parquet"))
+    try:
+        return archive_file(data_dir, tmp_path, name, kind='table')
+    finally:
+        os.remove(tmp_path)
+
+
+# Snapshots in the order they were taken, optionally only those of a name and/or run folder
+def list_snapshots(name=None, run=None):
+    path = os.path.join(get_archive_dir(), INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        snapshots = [json.loads(line) for line in f if line.strip()]
+    return [snapshot for snapshot in snapshots
+            if (name is None or snapshot['name'] == name) and (run is None or snapshot['run'] == run)]
+
+
+# Latest snapshot of name, of the run folder if given, taken at or before at (an ISO time) if given
+def find_snapshot(name, run=None, at=None):
+    snapshots = [snapshot for snapshot in list_snapshots(name, run) if at is None or snapshot['archived'] <= at]
+    if not snapshots:
+        raise FileNotFoundError(f"No archived snapshot of '{name}'"
+                                f"{f' from {run}' if run else ''}{f' at or before {at}' if at else ''}.")
+    return snapshots[-1]
+
+
+# Load an archived table as a DataFrame
+def load_archived_table(name, run=None, at=None):
+    snapshot = find_snapshot(name, run, at)
+    return pd.read_parquet(object_path(get_archive_dir(), snapshot['hash'], 'table'))
+
+
+# Write a snapshot back out as a file (tables as Parquet, other files as they were)
+def restore_snapshot(snapshot, output_path):
+    source = object_path(get_archive_dir(), snapshot['hash'], snapshot['kind'])
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    if snapshot['kind'] == 'table':
+        shutil.copyfile(source, output_path)
+    else:
+        with gzip.open(source, 'rb') as f, open(output_path, 'wb') as target:
+            shutil.copyfileobj(f, target)
+    return output_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="List or restore archived tables and workbooks.")
+    parser.add_argument('name', nargs='?', help="Table or file name, e.g. unrwa_trucks_kcal or unrwa_trucks.xlsx.")
+    parser.add_argument('--date', help="Only snapshots of the 'UNRWA Truck Data_YYYYMMDD' folder of this date.")
+    parser.add_argument('--at', help="Latest snapshot taken at or before this time (YYYY-MM-DDTHH:MM:SS).")
+    parser.add_argument('--restore', metavar='PATH', help="Write the snapshot to this file instead of listing.")
+    args = parser.parse_args()
+
+    run = os.path.basename(get_data_dir(args.date)) if args.date else None
+    if args.restore:
+        if not args.name:
+            parser.error("Give the name of the snapshot to restore.")
+        print(f"Restored to {restore_snapshot(find_snapshot(args.name, run, args.at), args.restore)}.")
+    else:
+        for snapshot in list_snapshots(args.name, run):
+            if args.at is None or snapshot['archived'] <= args.at:
+                print(f"{snapshot['archived']}  {snapshot['run']:<28} {snapshot['name']:<24} "
+                      f"{snapshot['hash'][:12]}  {snapshot['bytes']:>12} bytes")
@@ -0,0 +1,168 @@
+import argparse
+import glob
+import os
+import re
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import history
+import incremental
+import parallel_match
+import reference_cache
+import stage_cache
+from pipeline import get_stage, load_stage_module, run_pipeline
+from profiling import RunReport
+from store import get_cache_dir, get_desktop
+from supply_page import read_supply_page
+
+# =====================
+# MULTI-DAY BACKFILL
+# =====================
+# Rebuilds the dated folders of a range of days (e.g. after a change to the
+# matching rules or the kcal reference) from the raw export each folder already
+# holds, one day per worker process. The kcal reference is brought up to date
+# once and every worker runs against that version from the local reference cache,
+# and matches are shared through the on-disk match cache. Each day gets its usual
+# store, workbook and run report; the daily totals and monthly humanitarian food
+# MT of all days are then merged into one series in UNRWA Truck Data_cache/backfill,
+# each date (or month) taken from the latest run that covers it.
+
+BACKFILL_DIRNAME = 'backfill'
+RAW_FILE = 'unrwa_trucks_raw.xlsx'
+
+# Steps run for each day; step 1 is replaced by reading the folder's raw export
+BACKFILL_STEPS = list(range(2, 8))
+
+# Consolidated table -> column that identifies its rows
+CONSOLIDATED_TABLES = {
+    'unrwa_daily_entries': 'date',
+    'monthly_hfa': 'month',
+}
+
+# Prefixes of the count columns of the daily totals, in the order step 5 writes them
+DAILY_COUNT_GROUPS = ['count_daily_truck_', 'count_daily_sector_', 'entry_', 'cargo_type_']
+
+
+# Dates (YYYYMMDD) of the dated folders that hold a raw export, optionally only
+# those between start and end (inclusive) or in dates
+def find_run_dates(start=None, end=None, dates=None):
+    found = []
+    for path in glob.glob(os.path.join(get_desktop(), "UNRWA Truck Data_*")):
+        match = re.fullmatch(r"UNRWA Truck Data_(\d{8})", os.path.basename(path))
+        if match and os.path.exists(os.path.join(path, RAW_FILE)):
+            found.append(match.group(1))
+    return sorted(date for date in found
+                  if (start is None or date >= start) and (end is None or date <= end)
+                  and (dates is None or date in dates))
+
+
+def _init_worker(environment):
+    os.environ.update(environment)
+    # Days run one after another in each worker: full runs, no nested pools,
+    # and the shared history, incremental state and stage cache are left alone
+    # (every day has its own inputs, so the stage cache would only be written)
+    os.environ.pop(incremental.INCREMENTAL_ENV, None)
+    os.environ[history.HISTORY_ENV] = '0'
+    os.environ[stage_cache.STAGE_CACHE_ENV] = '0'
+    os.environ[parallel_match.WORKERS_ENV] = '1'
+
+
+# Run steps 2-7 for one day in a worker. Returns the consolidated tables of that day,
+# or the error that stopped it.
+def _run_day(run_date):
+    data_dir = os.path.join(get_desktop(), f"UNRWA Truck Data_{run_date}")
+    report = RunReport()
+    try:
+        raw, _ = read_supply_page(os.path.join(data_dir, RAW_FILE))
+        tables = run_pipeline(data_dir, numbers=BACKFILL_STEPS, report=report, inputs={'unrwa_raw': raw})
+    except Exception:
+        return run_date, None, traceback.format_exc()
+    finally:
+        if report.stages:
+            report.write(data_dir)
+    return run_date, {name: tables[name] for name in CONSOLIDATED_TABLES}, None
+
+
+# One series from the tables of every day: rows from later runs replace those of earlier ones
+def consolidate(results, name):
+    key = CONSOLIDATED_TABLES[name]
+    parts = [tables[name].assign(run_date=run_date) for run_date, tables in sorted(results.items())]
+    combined = pd.concat(parts, ignore_index=True)
+    combined = combined.drop_duplicates(key, keep='last').sort_values(key).reset_index(drop=True)
+    # Crossings or types missing from a run had no trucks in it: fill their pivot
+    # columns as steps 5 and 6 do, and put them where a single run would
+    groups = pivot_groups(name, combined.columns)
+    columns = [col for group in groups for col in group]
+    combined[columns] = combined[columns].fillna(0)
+    if name == 'unrwa_daily_entries':
+        combined[columns] = combined[columns].astype(int)
+    other = [col for col in combined.columns if col not in columns and col != 'run_date']
+    return combined[other + columns + ['run_date']]
+
+
+# Columns of a consolidated table that come from pivots by crossing, sector or type,
+# which steps 5 and 6 fill with 0, in groups in the order the step writes them (each
+# group sorted, like a pivot's columns): the count columns of the daily totals
+# (step 5) and the crossing columns of the monthly humanitarian food MT (step 6)
+def pivot_groups(name, columns):
+    if name == 'monthly_hfa':
+        return [sorted(col for col in columns if col not in (CONSOLIDATED_TABLES[name], 'run_date'))]
+    count_columns = [col for col in columns if 'count' in col]
+    groups = [sorted(col for col in count_columns if col.startswith(prefix)) for prefix in DAILY_COUNT_GROUPS]
+    grouped = {col for group in groups for col in group}
+    return groups + [[col for col in count_columns if col not in grouped]]
+
+
+# Rebuild the folders of run_dates on workers processes and save the consolidated series.
+# Returns the paths of the consolidated tables and the dates that failed.
+def run_backfill(run_dates, workers=None):
+    # Bring the kcal reference up to date once and pin every worker to that version
+    kcal_ref_url = load_stage_module(get_stage(3)).kcal_ref_url
+    environment = {reference_cache.PIN_VERSION_ENV: reference_cache.update_reference(kcal_ref_url)}
+
+    workers = min(workers or os.cpu_count() or 1, len(run_dates))
+    print(f"Backfilling {len(run_dates)} days on {workers} worker processes.")
+    results = {}
+    failed = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(environment,)) as pool:
+        futures = [pool.submit(_run_day, run_date) for run_date in run_dates]
+        for future in as_completed(futures):
+            run_date, tables, error = future.result()
+            if error is None:
+                results[run_date] = tables
+                print(f"{run_date}: done.")
+            else:
+                failed[run_date] = error
+                print(f"{run_date}: failed.\n{error}")
+
+    paths = {}
+    if results:
+        output_dir = os.path.join(get_cache_dir(), BACKFILL_DIRNAME)
+        os.makedirs(output_dir, exist_ok=True)
+        for name in CONSOLIDATED_TABLES:
+            path = os.path.join(output_dir, f"{name}_{min(results)}_{max(results)}.csv")
+            consolidate(results, name).to_csv(path, index=False)
+            paths[name] = path
+    return paths, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebuild the dated folders of several days in parallel from their raw exports.")
+    parser.add_argument('--start', help="First day to rebuild (YYYYMMDD).")
+    parser.add_argument('--end', help="Last day to rebuild (YYYYMMDD).")
+    parser.add_argument('--dates', nargs='+', help="Rebuild only these days (YYYYMMDD).")
+    parser.add_argument('--workers', type=int, help="Number of worker processes (every core by default).")
+    args = parser.parse_args()
+
+    run_dates = find_run_dates(args.start, args.end, set(args.dates) if args.dates else None)
+    if not run_dates:
+        print("No dated folders with a raw export in that range.")
+        sys.exit(1)
+
+    paths, failed = run_backfill(run_dates, workers=args.workers)
+    for name, path in paths.items():
+        print(f"Consolidated '{name}' saved to {path}.")
+    if failed:
+        print(f"{len(failed)} of {len(run_dates)} days failed: {', '.join(sorted(failed))}.")
+        sys.exit(1)
@@ -0,0 +1,192 @@
+import argparse
+import functools
+import glob
+import http.server
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+import pandas as pd
+from synthetic import DEFAULT_KCAL_REFERENCE, generate_supply_page, write_supply_page
+
+# =====================
+# BENCHMARK SUITE
+# =====================
+# Times every step of the pipeline, one at a time and end to end, on synthetic
+# Supply Page workbooks of a given size. Everything runs offline: the synthetic
+# export and kcal_reference.xlsx are served by a local HTTP server and the data
+# folders live under the benchmark folder instead of the desktop. Each run is a
+# fresh 0.master_script.py process, so its run report (see profiling.py) gives
+# the per-step wall time, rows/sec and peak memory. Results are saved as JSON
+# and can be compared with an earlier results file.
+
+SIZES = {'10k': 10000, '100k': 100000, '1m': 1000000}
+
+DEFAULT_BENCHMARK_DIR = os.path.join(os.path.expanduser("~"), "UNRWA Truck Benchmarks")
+
+_repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_size(size):
+    if size.lower() in SIZES:
+        return SIZES[size.lower()]
+    return int(size)
+
+
+# Synthetic export for a size and seed, generated once and reused by later benchmarks
+def get_input_workbook(inputs_dir, n_rows, seed):
+    path = os.path.join(inputs_dir, f"supply_page_{n_rows}_{seed}.xlsx")
+    if not os.path.exists(path):
+        print(f"Generating a synthetic Supply Page with {n_rows} rows...")
+        start = time.perf_counter()
+        write_supply_page(generate_supply_page(n_rows, seed=seed), path)
+        print(f"Generated {path} in {time.perf_counter() - start:.1f}s.")
+    return path
+
+
+# Serve directory on a free local port from a background thread
+def start_server(directory):
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+# Run the whole pipeline once in a fresh process and return its run report
+def run_once(data_root, export_url, kcal_ref_url):
+    env = dict(os.environ)
+    env.pop('UNRWA_INCREMENTAL', None)
+    env.update({
+        # Every step is timed doing its work, not loading it from the stage cache
+        'UNRWA_STAGE_CACHE': '0',
+        'UNRWA_DATA_ROOT': data_root,
+        'UNRWA_SUPPLY_PAGE_URL': export_url,
+        'UNRWA_KCAL_REFERENCE_URL': kcal_ref_url,
+    })
+    command = [sys.executable, os.path.join(_repo_dir, '0.master_script.py'), '--force']
+    start = time.perf_counter()
+    completed = subprocess.run(command, env=env, cwd=_repo_dir, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"Pipeline failed with exit code {completed.returncode}:\n{completed.stdout[-2000:]}"
+                           f"{completed.stderr[-2000:]}")
+
+    reports = sorted(glob.glob(os.path.join(data_root, "UNRWA Truck Data_2*", "reports", "run_report_*.json")))
+    with open(reports[-1], 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    report['process_wall_seconds'] = round(wall, 4)
+    return report
+
+
+# Remove the dated data folders of earlier runs; warm runs keep the shared cache folder
+def reset_data_root(data_root, warm):
+    for path in glob.glob(os.path.join(data_root, "UNRWA Truck Data_*")):
+        if warm and path.endswith("_cache"):
+            continue
+        shutil.rmtree(path)
+
+
+# Median wall time per step, plus the end-to-end times
+def summarize(runs):
+    stage_times = {}
+    for run in runs:
+        for stage in run['stages']:
+            stage_times.setdefault(stage['stage'], []).append(stage['wall_seconds'])
+    summary = {stage: round(statistics.median(times), 4) for stage, times in stage_times.items()}
+    summary['end_to_end'] = round(statistics.median(run['total_wall_seconds'] for run in runs), 4)
+    summary['end_to_end_process'] = round(statistics.median(run['process_wall_seconds'] for run in runs), 4)
+    return summary
+
+
+def run_benchmarks(sizes, repeat=3, seed=0, benchmark_dir=DEFAULT_BENCHMARK_DIR, warm=False):
+    inputs_dir = os.path.join(benchmark_dir, 'inputs')
+    os.makedirs(inputs_dir, exist_ok=True)
+    shutil.copyfile(DEFAULT_KCAL_REFERENCE, os.path.join(inputs_dir, 'kcal_reference.xlsx'))
+
+    results = {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'seed': seed,
+        'warm_cache': warm,
+        'sizes': {},
+    }
+    server, base_url = start_server(inputs_dir)
+    try:
+        for n_rows in sizes:
+            workbook = get_input_workbook(inputs_dir, n_rows, seed)
+            data_root = os.path.join(benchmark_dir, 'runs', str(n_rows))
+            reset_data_root(data_root, warm=False)
+
+            runs = []
+            for i in range(repeat):
+                reset_data_root(data_root, warm=warm)
+                report = run_once(data_root, f"{base_url}/{os.path.basename(workbook)}",
+                                  f"{base_url}/kcal_reference.xlsx")
+                runs.append(report)
+                print(f"{n_rows} rows, run {i + 1}/{repeat}: {report['total_wall_seconds']:.2f}s "
+                      f"({report['process_wall_seconds']:.2f}s with interpreter start-up)")
+            results['sizes'][str(n_rows)] = {'rows': n_rows, 'median_seconds': summarize(runs), 'runs': runs}
+    finally:
+        server.shutdown()
+    return results
+
+
+def save_results(results, benchmark_dir):
+    results_dir = os.path.join(benchmark_dir, 'results')
+    os.makedirs(results_dir, exist_ok=True)
+    timestamp = results['started'].replace('-', '').replace(':', '').replace('T', '')
+    path = os.path.join(results_dir, f"benchmark_{timestamp}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+# Table of median step times, with the ratio to a previous results file when given
+def format_results(results, previous=None):
+    lines = []
+    for size, result in results['sizes'].items():
+        lines.append(f"--- {size} rows")
+        before = (previous or {}).get('sizes', {}).get(size, {}).get('median_seconds', {})
+        for stage, seconds in result['median_seconds'].items():
+            line = f"{stage:<28} {seconds:>9.3f}s"
+            if before.get(stage):
+                line += f"   was {before[stage]:.3f}s ({seconds / before[stage]:.2f}x)"
+            lines.append(line)
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic Supply Page workbooks.")
+    parser.add_argument('--sizes', nargs='+', default=['10k'],
+                        help="Row counts to benchmark, as numbers or 10k / 100k / 1m.")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per size; the median is reported.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic workbooks.")
+    parser.add_argument('--dir', default=DEFAULT_BENCHMARK_DIR,
+                        help="Folder for the synthetic inputs, run folders and results.")
+    parser.add_argument('--warm', action='store_true',
+                        help="Keep the match cache and download state between runs of the same size.")
+    parser.add_argument('--compare', help="Earlier results file to compare with.")
+    args = parser.parse_args()
+
+    results = run_benchmarks([parse_size(size) for size in args.sizes], repeat=args.repeat, seed=args.seed,
+                             benchmark_dir=args.dir, warm=args.warm)
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    print(format_results(results, previous))
+    print(f"Results saved to {save_results(results, args.dir)}.")
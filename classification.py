@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+# =====================
+# TRUCK CLASSIFICATION
+# =====================
+# Truck type, sector and cargo type are defined by the rule tables below.
+# Rules are tried in order and the first one that matches gives the label;
+# trucks no rule matches get the default. Each table is turned into boolean
+# masks over whole columns (text rules only look at each distinct value once),
+# so classifying a run is a few array operations. Step 4 stores all three
+# labels on the truck table, and steps 5 and 6 use the stored labels.
+
+# Truck type from the number of food items and items on the truck.
+# min/max_food_items bound the food item count, min_food_share the share of items that are food.
+TRUCK_TYPE_RULES = [
+    {'label': 'Food Truck', 'min_food_items': 1, 'min_food_share': 1.0},
+    {'label': 'Non-Food Truck', 'max_food_items': 0},
+]
+TRUCK_TYPE_DEFAULT = 'Mixed Food/Non-Food Truck'
+
+# Sector from 'Donation Type', matched case-insensitively as a substring
+SECTOR_RULES = [
+    {'label': 'private', 'contains': 'private sector'},
+    {'label': 'humanitarian', 'contains': 'humanitarian'},
+]
+SECTOR_DEFAULT = 'unknown'
+
+# Cargo type from truck type
+CARGO_TYPE_RULES = [
+    {'label': 'food', 'equals': 'Food Truck'},
+    {'label': 'nonfood', 'equals': 'Non-Food Truck'},
+    {'label': 'mixed', 'equals': 'Mixed Food/Non-Food Truck'},
+]
+CARGO_TYPE_DEFAULT = 'unknown'
+
+
+# Evaluate count rules on arrays of food item and item counts
+def _count_masks(rules, food_items, items):
+    food_items = np.asarray(food_items, dtype=float)
+    items = np.asarray(items, dtype=float)
+    food_share = np.divide(food_items, items, out=np.zeros_like(food_items), where=items > 0)
+    masks = []
+    for rule in rules:
+        mask = np.ones(len(food_items), dtype=bool)
+        if 'min_food_items' in rule:
+            mask &= food_items >= rule['min_food_items']
+        if 'max_food_items' in rule:
+            mask &= food_items <= rule['max_food_items']
+        if 'min_food_share' in rule:
+            mask &= food_share >= rule['min_food_share']
+        masks.append(mask)
+    return masks
+
+
+# Evaluate text rules on each distinct value once and spread the labels back over values.
+# Missing values are matched as the text 'nan', like str() of a missing value.
+def _text_labels(rules, default, values):
+    codes, uniques = pd.factorize(pd.Series(values).astype(object))
+    text = pd.Series(list(uniques) + [np.nan], dtype=object).astype(str)
+    masks = []
+    for rule in rules:
+        if 'contains' in rule:
+            masks.append(text.str.lower().str.contains(rule['contains'], regex=False).values)
+        else:
+            masks.append((text == rule['equals']).values)
+    labels = np.select(masks, [rule['label'] for rule in rules], default=default).astype(object)
+    # Code -1 (missing) picks the label of the trailing 'nan' entry
+    return pd.Series(labels[codes], index=pd.Series(values).index)
+
+
+def classify_truck_type(food_item_count, item_count):
+    masks = _count_masks(TRUCK_TYPE_RULES, food_item_count, item_count)
+    labels = np.select(masks, [rule['label'] for rule in TRUCK_TYPE_RULES], default=TRUCK_TYPE_DEFAULT)
+    return pd.Series(labels.astype(object), index=food_item_count.index)
+
+
+def classify_sector(donation_type):
+    return _text_labels(SECTOR_RULES, SECTOR_DEFAULT, donation_type)
+
+
+def classify_cargo_type(truck_type):
+    return _text_labels(CARGO_TYPE_RULES, CARGO_TYPE_DEFAULT, truck_type)
+
+
+# Add 'truck_type', 'sector' and 'cargo_type' to a truck table with item counts
+def classify_trucks(data):
+    data['truck_type'] = classify_truck_type(data['food_item_count'], data['item_count'])
+    data['sector'] = classify_sector(data['Donation Type'])
+    data['cargo_type'] = classify_cargo_type(data['truck_type'])
+    return data
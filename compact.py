@@ -0,0 +1,71 @@
+import os
+import numpy as np
+import pandas as pd
+from pandas.api.types import infer_dtype, is_float_dtype, is_integer_dtype
+
+# =====================
+# COMPACT DTYPE MODE
+# =====================
+# With UNRWA_COMPACT=1, steps 2-4 shrink their tables before handing them on:
+# low-cardinality text columns become categoricals, integers get the smallest
+# type that holds them and floats become float32. Parquet keeps these types, so
+# later steps load them compact too. float32 keeps about 7 significant digits,
+# which is plenty for weights and kcals; the workbook export writes them back
+# as float64 with their shortest decimal form.
+
+COMPACT_ENV = 'UNRWA_COMPACT'
+
+# Text columns that are always stored as categoricals
+CATEGORY_COLUMNS = [
+    'unit', 'Donation Type', 'Crossing', 'Cargo Category', 'Donating Country/ Organization',
+    'sector', 'truck_type', 'cargo_type', 'item', 'item_processed', 'match_type', 'matched',
+]
+
+# Other text columns become categoricals when at most this share of their values are distinct
+CATEGORY_MAX_SHARE = 0.5
+
+
+def is_enabled():
+    return os.environ.get(COMPACT_ENV, '').strip() not in ('', '0')
+
+
+def _should_categorize(col, values):
+    if infer_dtype(values, skipna=True) not in ('string', 'empty'):
+        return False
+    if col in CATEGORY_COLUMNS:
+        return True
+    return values.nunique(dropna=True) <= CATEGORY_MAX_SHARE * len(values)
+
+
+# Return data with the compact schema applied; columns already compact are left alone
+def compact_table(data):
+    data = data.copy()
+    for col in data.columns:
+        values = data[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            continue
+        if values.dtype == object:
+            if len(values) and _should_categorize(col, values):
+                data[col] = values.astype('category')
+        elif is_integer_dtype(values.dtype):
+            data[col] = pd.to_numeric(values, downcast='integer')
+        elif is_float_dtype(values.dtype) and values.dtype != np.float32:
+            data[col] = values.astype(np.float32)
+    return data
+
+
+# Undo compact types that don't belong in the workbook: float32 back to float64
+# through their shortest decimal form, so 28.05 isn't written as 28.049999237
+def expand_floats(data):
+    float32_columns = [col for col in data.columns if data[col].dtype == np.float32]
+    if not float32_columns:
+        return data
+    data = data.copy()
+    for col in float32_columns:
+        data[col] = data[col].astype(str).astype(np.float64)
+    return data
+
+
+# Memory used by tables in MB, counting the contents of text columns
+def memory_mb(*tables):
+    return round(sum(table.memory_usage(deep=True).sum() for table in tables) / (1024 * 1024), 2)
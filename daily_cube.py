@@ -0,0 +1,42 @@
+# =====================
+# DAILY CUBE
+# =====================
+# Step 5 aggregates the trucks of step 4 once, into a cube with one row per
+# date, truck type, sector, cargo type and crossing that had trucks, holding the
+# truck count and the kcal, food MT and weight totals of those trucks. Cargo type
+# follows from truck type, so it adds no rows. unrwa_daily_entries and its count
+# columns are sums over the cube, which has a few hundred rows per day at most,
+# so no breakdown has to scan the truck rows again.
+
+CUBE_DIMENSIONS = ['date', 'truck_type', 'sector', 'cargo_type', 'Crossing']
+
+# Measure column -> (truck column, aggregation)
+CUBE_MEASURES = {
+    'trucks': ('ID', 'count'),
+    'kcal': ('truck_kcal', 'sum'),
+    'food_mt': ('truck_food_mt', 'sum'),
+    'weight_kg': ('truck_weight_kg', 'sum'),
+}
+
+# Truck columns the cube is built from
+CUBE_INPUT_COLUMNS = CUBE_DIMENSIONS + [column for column, _ in CUBE_MEASURES.values()]
+
+
+# Build the cube from trucks with the dimension and measure columns. Trucks without
+# a date are left out; trucks without a crossing are kept with a missing Crossing.
+def build_cube(data):
+    data = data[data['date'].notna()]
+    dimensions = [col for col in CUBE_DIMENSIONS if col in data.columns]
+    cube = data.groupby(dimensions, dropna=False, observed=True, sort=True).agg(**CUBE_MEASURES)
+    return cube.reset_index()
+
+
+# Trucks per date for each value of a dimension, one column per value
+def count_by(cube, dimension):
+    return cube.pivot_table(index='date', columns=dimension, values='trucks', aggfunc='sum', fill_value=0,
+                            observed=True)
+
+
+# Totals per date over every other dimension
+def daily_totals(cube):
+    return cube.groupby('date', sort=True)[list(CUBE_MEASURES)].sum()
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import requests
+from urllib3.exceptions import ProtocolError
+from profiling import count
+
+# =====================
+# STREAMING, CONDITIONAL DOWNLOADS
+# =====================
+# Files are streamed to disk in chunks through a temporary file that is only
+# moved into place once complete. ETag / Last-Modified from the previous
+# download are sent back so an unchanged export costs a 304, and the SHA-256
+# of the content catches servers (like the Google Sheets export) that always
+# send the full file.
+
+# Exit code used by scripts when the input has not changed and there is nothing to do
+EXIT_UNCHANGED = 3
+
+# HTTP status codes worth retrying
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Request errors worth retrying: failed or timed out connections, and connections
+# dropped or garbled part way through the body (the partial file is removed first)
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.ContentDecodingError, ProtocolError)
+
+
+# Seconds to wait for a connection and between bytes of a response
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+_local = threading.local()
+
+
+class DownloadError(Exception):
+    pass
+
+
+class _RetryableStatus(Exception):
+    pass
+
+
+def read_state(state_path):
+    if not os.path.exists(state_path):
+        return {}
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_state(state_path, state):
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, state_path)
+
+
+# Session of the current thread, reused by its downloads so repeated requests to a
+# host keep their connection open (sessions aren't shared between threads)
+def get_session():
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
+# Stream a response body into output_path atomically, returning (sha256, bytes written)
+def _stream_to_file(response, output_path, chunk_size):
+    digest = hashlib.sha256()
+    size = 0
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir, prefix='.download_', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest.hexdigest(), size
+
+
+# Download url to output_path. previous_state is the dict returned by an earlier
+# call; its validators make the request conditional and its sha256 tells whether
+# the content changed. Returns the new state with 'changed' set accordingly.
+# Setting the threading.Event cancel stops a download running on another thread
+# before its next attempt, or during the wait before it.
+def download_file(url, output_path, previous_state=None, session=None,
+                  timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), retries=3, backoff=2.0, chunk_size=1024 * 1024,
+                  cancel=None):
+    previous_state = previous_state or {}
+    session = session or get_session()
+
+    # Only send validators if we still have the file they describe
+    headers = {}
+    if os.path.exists(output_path):
+        if previous_state.get('etag'):
+            headers['If-None-Match'] = previous_state['etag']
+        if previous_state.get('last_modified'):
+            headers['If-Modified-Since'] = previous_state['last_modified']
+
+    for attempt in range(retries + 1):
+        if cancel is not None and cancel.is_set():
+            raise DownloadError("Download cancelled.")
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 304:
+                    return dict(previous_state, changed=False)
+                if response.status_code in RETRY_STATUS_CODES:
+                    raise _RetryableStatus(f"HTTP Status Code: {response.status_code}")
+                if response.status_code != 200:
+                    raise DownloadError(f"HTTP Status Code: {response.status_code}")
+
+                sha256, size = _stream_to_file(response, output_path, chunk_size)
+                count('bytes_downloaded', size)
+                return {
+                    'url': url,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'sha256': sha256,
+                    'bytes': size,
+                    'changed': sha256 != previous_state.get('sha256'),
+                }
+        except (*RETRY_ERRORS, _RetryableStatus) as e:
+            if attempt == retries:
+                raise DownloadError(f"{e} (gave up after {retries + 1} attempts)") from e
+            wait = backoff * (2 ** attempt)
+            print(f"Download attempt {attempt + 1} failed ({e}). Retrying in {wait:.0f}s...")
+            if cancel is not None:
+                cancel.wait(wait)
+            else:
+                time.sleep(wait)
+        except requests.RequestException as e:
+            # Not worth retrying (e.g. an invalid URL or too many redirects)
+            raise DownloadError(str(e)) from e
@@ -0,0 +1,76 @@
+import difflib
+import numpy as np
+from profiling import count
+
+# =====================
+# FUZZY MATCHING INDEX
+# =====================
+# Finds the closest reference item for a batch of strings with exactly the
+# result of difflib.get_close_matches(query, choices, n=1, cutoff=cutoff), but
+# without scoring every choice. difflib's similarity ratio is 2*M / (len(a) + len(b)),
+# where M, the number of matching characters, can't exceed the characters the two
+# strings have in common. The index keeps each choice's length and character
+# counts in arrays, so those two upper bounds are computed for all choices at
+# once, and the full ratio is only computed for the few choices whose bound
+# reaches the cutoff. These are the same bounds difflib checks before its own
+# ratio, so the results are identical, ties included.
+#
+# Trigram (n-gram) candidate filters were tried and left out: on strings as short
+# as cargo items (about 10 characters) one typo removes up to three of the few
+# trigrams, so any trigram threshold either drops true matches or prunes nothing.
+
+
+class FuzzyIndex:
+    def __init__(self, choices):
+        # Distinct choices in first-seen order; duplicates never change the best match
+        self.choices = list(dict.fromkeys(choices))
+        self.lengths = np.array([len(choice) for choice in self.choices], dtype=np.int64)
+
+        # Character counts per choice, one column per character used by any choice
+        self.columns = {char: i for i, char in enumerate(sorted(set(''.join(self.choices))))}
+        self.char_counts = np.zeros((len(self.choices), len(self.columns)), dtype=np.int64)
+        for row, choice in enumerate(self.choices):
+            for char in choice:
+                self.char_counts[row, self.columns[char]] += 1
+
+    def __len__(self):
+        return len(self.choices)
+
+    # Upper bounds of the ratio between query and every choice, as difflib's real_quick_ratio and quick_ratio
+    def _bounds(self, query):
+        total = self.lengths + len(query)
+        query_counts = np.zeros(len(self.columns), dtype=np.int64)
+        for char in query:
+            if char in self.columns:
+                query_counts[self.columns[char]] += 1
+        common = np.minimum(self.char_counts, query_counts).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            length_bound = np.where(total > 0, 2.0 * np.minimum(self.lengths, len(query)) / total, 1.0)
+            char_bound = np.where(total > 0, 2.0 * common / total, 1.0)
+        return length_bound, char_bound
+
+    # Closest choice to query with a ratio of at least cutoff, or None
+    def best_match(self, query, cutoff=0.85):
+        count('fuzzy_match_calls')
+        if not self.choices:
+            return None
+        length_bound, char_bound = self._bounds(query)
+        candidates = np.flatnonzero((length_bound >= cutoff) & (char_bound >= cutoff))
+
+        # Score candidates the way get_close_matches does: the query is the second sequence
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(query)
+        best = None
+        for row in candidates:
+            choice = self.choices[row]
+            matcher.set_seq1(choice)
+            count('fuzzy_ratio_calls')
+            score = matcher.ratio()
+            # get_close_matches keeps the highest (score, choice) pair
+            if score >= cutoff and (best is None or (score, choice) > best):
+                best = (score, choice)
+        return best[1] if best is not None else None
+
+    # Closest choice for each query in a batch, as a list in query order
+    def best_matches(self, queries, cutoff=0.85):
+        return [self.best_match(query, cutoff) for query in queries]
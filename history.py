@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import shutil
+import pandas as pd
+import pyarrow.parquet as pq
+from profiling import count, count_file_bytes
+from store import get_cache_dir, table_fingerprint, write_parquet
+
+# =====================
+# TRUCK HISTORY
+# =====================
+# Step 4 keeps the truck results and their item results in a history split by
+# month of 'date', in UNRWA Truck Data_cache/history/<trucks|items>/month=YYYY-MM.
+# Only the months whose rows changed since the last run are rewritten. query()
+# reads just the months a date range covers and just the columns asked for, and
+# filters rows on Crossing, sector, truck type or any other column while reading,
+# so a question about one month costs one month of data however long the history
+# gets. Steps 5 and 6 can run on a slice of the history for ad-hoc reports.
+# The history follows the newest dated folder: a run against an older folder
+# (--date) leaves it alone instead of dropping the months that came after it.
+
+# Set to 0 to leave the history alone (backfill runs of past days do)
+HISTORY_ENV = 'UNRWA_HISTORY'
+
+HISTORY_DIRNAME = 'history'
+MANIFEST_FILE = 'manifest.json'
+
+# Partition of rows without a date
+UNKNOWN_MONTH = 'unknown'
+
+# Command-line filters of the ad-hoc reports and the columns they filter
+QUERY_FILTERS = {'crossing': 'Crossing', 'sector': 'sector', 'truck_type': 'truck_type'}
+
+
+def is_enabled():
+    return os.environ.get(HISTORY_ENV, '').strip() != '0'
+
+
+def get_history_dir(name):
+    return os.path.join(get_cache_dir(), HISTORY_DIRNAME, name)
+
+
+def partition_path(name, month):
+    return os.path.join(get_history_dir(name), f"month={month}", "part.parquet")
+
+
+# Manifest of the history of name: the date of the run folder that last wrote it
+# and the fingerprint of each month
+def _read_manifest(name):
+    path = os.path.join(get_history_dir(name), MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'run_date': None, 'months': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    # Manifests written before run dates were recorded only hold the months
+    if 'months' not in manifest:
+        manifest = {'run_date': None, 'months': manifest}
+    return manifest
+
+
+def _write_manifest(name, manifest):
+    path = os.path.join(get_history_dir(name), MANIFEST_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+# Months ('YYYY-MM', or 'unknown') of a date column
+def month_keys(dates):
+    dates = pd.to_datetime(pd.Series(dates).reset_index(drop=True), errors='coerce')
+    return dates.dt.strftime('%Y-%m').fillna(UNKNOWN_MONTH)
+
+
+# Bring the history of name up to date with data, which holds every row (all months)
+# as of the run folder of run_date. Months whose rows are unchanged are left alone;
+# months with no rows left are removed. A history last written by a newer run folder
+# is left as it is.
+def write_history(name, data, run_date=None):
+    history_dir = get_history_dir(name)
+    os.makedirs(history_dir, exist_ok=True)
+    manifest = _read_manifest(name)
+    if run_date is not None and manifest['run_date'] is not None and run_date < manifest['run_date']:
+        print(f"History '{name}' left alone: it holds the newer run of {manifest['run_date']}.")
+        count('history_updates_skipped')
+        return manifest['months']
+    data = data.reset_index(drop=True)
+    months = month_keys(data['date'])
+
+    new_manifest = {}
+    for month, rows in data.groupby(months.values, sort=True).groups.items():
+        part = data.loc[rows].reset_index(drop=True)
+        digest = table_fingerprint(part)
+        new_manifest[month] = digest
+        if manifest['months'].get(month) == digest and os.path.exists(partition_path(name, month)):
+            continue
+        write_parquet(part, partition_path(name, month))
+        count('history_partitions_written')
+
+    for month in set(manifest['months']) - set(new_manifest):
+        shutil.rmtree(os.path.dirname(partition_path(name, month)), ignore_errors=True)
+    _write_manifest(name, {'run_date': run_date or manifest['run_date'], 'months': new_manifest})
+    return new_manifest
+
+
+# Months stored in the history of name, in order
+def stored_months(name):
+    return sorted(_read_manifest(name)['months'])
+
+
+# Rows of the history of name with a date between start and end (inclusive; either can
+# be None), only reading the months in that range. columns limits the columns read and
+# filters keeps only rows whose column has the given value (or one of a list of values).
+def query(name, start=None, end=None, columns=None, filters=None):
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    months = stored_months(name)
+    if start is not None or end is not None:
+        first = start.strftime('%Y-%m') if start is not None else ''
+        last = end.strftime('%Y-%m') if end is not None else '9999-99'
+        months = [month for month in months if month != UNKNOWN_MONTH and first <= month <= last]
+
+    row_filters = []
+    for column, values in (filters or {}).items():
+        values = list(values) if isinstance(values, (list, tuple, set)) else [values]
+        row_filters.append((column, 'in', values))
+    if start is not None:
+        row_filters.append(('date', '>=', start))
+    if end is not None:
+        # The whole end day, whatever the time of day
+        row_filters.append(('date', '<', end.normalize() + pd.Timedelta(days=1)))
+
+    parts = []
+    for month in months:
+        path = partition_path(name, month)
+        # Months written before a column existed are read without it
+        available = pq.read_schema(path).names
+        month_columns = None if columns is None else [col for col in columns if col in available]
+        month_filters = [row_filter for row_filter in row_filters if row_filter[0] in available]
+        count_file_bytes('bytes_read', path)
+        table = pq.read_table(path, columns=month_columns, filters=month_filters or None)
+        parts.append(table.to_pandas())
+    count('history_partitions_read', len(parts))
+    if not parts:
+        return pd.DataFrame(columns=columns or [])
+    return pd.concat(parts, ignore_index=True)
+
+
+# Options of the ad-hoc reports run on a slice of the history
+def add_query_arguments(parser):
+    parser.add_argument('--start', help="Only trucks from this date on (YYYY-MM-DD), read from the history.")
+    parser.add_argument('--end', help="Only trucks up to this date (YYYY-MM-DD), read from the history.")
+    for option, column in QUERY_FILTERS.items():
+        parser.add_argument(f"--{option.replace('_', '-')}", dest=option, nargs='+',
+                            help=f"Only trucks with one of these values of '{column}'.")
+
+
+# Filters given on the command line, as query() takes them; an empty dict if none were
+def query_filters(args):
+    return {column: getattr(args, option) for option, column in QUERY_FILTERS.items() if getattr(args, option)}
+
+
+def is_query(args):
+    return bool(args.start or args.end or query_filters(args))
+
+
+# Path of an ad-hoc report in the reports folder of data_dir, named after its query
+def query_report_path(data_dir, name, args):
+    parts = [name, args.start or 'start', args.end or 'end']
+    for column, values in query_filters(args).items():
+        parts.append('-'.join(str(value) for value in values))
+    file_name = '_'.join(parts).replace(' ', '-').replace('/', '-') + '.csv'
+    return os.path.join(data_dir, 'reports', file_name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query the truck or item history by date range and filters.")
+    parser.add_argument('name', nargs='?', default='trucks', choices=['trucks', 'items'], help="History to query.")
+    parser.add_argument('--columns', nargs='+', help="Only read these columns.")
+    parser.add_argument('--output', help="Save the rows to this CSV file instead of printing a summary.")
+    add_query_arguments(parser)
+    args = parser.parse_args()
+
+    rows = query(args.name, args.start, args.end, columns=args.columns, filters=query_filters(args))
+    if args.output:
+        rows.to_csv(args.output, index=False)
+        print(f"{len(rows)} rows saved to {args.output}.")
+    else:
+        print(f"{len(rows)} rows in {len(stored_months(args.name))} stored months.")
+        print(rows.head(20).to_string())
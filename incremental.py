@@ -0,0 +1,188 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from store import get_cache_dir, load_table, save_table, table_exists
+
+# =====================
+# INCREMENTAL PROCESSING
+# =====================
+# With UNRWA_INCREMENTAL=1 the scripts only process Supply Page rows whose ID is
+# new or whose content changed since the last run, and merge the results into
+# the truck tables kept in the 'incremental' state folder of the shared cache.
+#
+# Step 2 fingerprints the raw rows by ID, works out the delta and records the
+# pending work for every later stage in pending.json: the IDs steps 3-4 must
+# recompute and the dates/months steps 5-6 must re-aggregate. Each stage clears
+# its own pending work after it has merged and saved its results, so a failed
+# stage simply picks up the same work again on the next run.
+
+INCREMENTAL_ENV = 'UNRWA_INCREMENTAL'
+
+FINGERPRINTS_TABLE = 'raw_fingerprints'
+PENDING_FILE = 'pending.json'
+
+# Stages downstream of step 2 and the kind of work they track
+ROW_STAGES = ['unrwa_trucks_kcal', 'unrwa_trucks_kcal_mt']
+DATE_STAGES = ['unrwa_daily_entries', 'monthly_hfa']
+
+
+def is_enabled():
+    return os.environ.get(INCREMENTAL_ENV, '').strip() not in ('', '0')
+
+
+def get_state_dir():
+    state_dir = os.path.join(get_cache_dir(), 'incremental')
+    os.makedirs(state_dir, exist_ok=True)
+    return state_dir
+
+
+# IDs as strings, so IDs read back from Parquet compare equal whatever their type
+def id_keys(ids):
+    return ids.astype(str).where(ids.notna(), None)
+
+
+# One fingerprint per ID: the wrapped sum of the content hashes of its rows and the row count
+def id_fingerprints(raw):
+    row_hash = pd.util.hash_pandas_object(raw, index=False).values.view(np.int64)
+    rows = pd.DataFrame({'id_key': id_keys(raw['ID']).values, 'row_hash': row_hash})
+    rows = rows[rows['id_key'].notna()]
+    return rows.groupby('id_key')['row_hash'].agg(['sum', 'count']).reset_index()
+
+
+# Compare the raw rows with the fingerprints of the last run.
+# Returns the mask of raw rows to process, the new fingerprints, and the ID keys
+# whose stored results must be replaced (changed, new or removed IDs).
+def find_delta(raw, previous_fingerprints):
+    fingerprints = id_fingerprints(raw)
+    if previous_fingerprints is None:
+        return pd.Series(True, index=raw.index), fingerprints, set(fingerprints['id_key'])
+
+    compared = fingerprints.merge(previous_fingerprints, on='id_key', how='outer',
+                                  suffixes=('', '_previous'), indicator=True)
+    changed = (compared['_merge'] != 'both') \
+        | (compared['sum'] != compared['sum_previous']) \
+        | (compared['count'] != compared['count_previous'])
+    replace_keys = set(compared.loc[changed, 'id_key'])
+
+    # Rows without an ID can't be matched to earlier results, so they are always reprocessed
+    keys = id_keys(raw['ID'])
+    mask = keys.isin(replace_keys) | keys.isna()
+    return mask, fingerprints, replace_keys
+
+
+# Drop the stored rows for replace_keys (and rows without an ID), add the freshly
+# processed rows, and put rows back in the order of order_ids
+def merge_by_id(previous, delta, replace_keys, order_ids=None):
+    if previous is None or previous.empty:
+        merged = delta.copy()
+    else:
+        keys = id_keys(previous['ID'])
+        keep = previous[~keys.isin(replace_keys) & keys.notna()]
+        # Keep the column order of the wider table (more item_N columns)
+        columns = list(delta.columns) if len(delta.columns) >= len(keep.columns) else list(keep.columns)
+        columns += [col for col in list(keep.columns) + list(delta.columns) if col not in columns]
+        merged = pd.concat([keep, delta], ignore_index=True)[columns]
+
+    if order_ids is not None:
+        position = pd.Series(np.arange(len(order_ids)), index=id_keys(pd.Series(order_ids)).values)
+        position = position[~position.index.duplicated()]
+        order = id_keys(merged['ID']).map(position).fillna(len(position))
+        merged = merged.iloc[np.argsort(order.values, kind='stable')]
+    return merged.reset_index(drop=True)
+
+
+# Normalized day strings ('YYYY-MM-DD') of a date column, without missing dates
+def day_keys(dates):
+    dates = pd.to_datetime(pd.Series(dates), errors='coerce').dropna()
+    return set(dates.dt.strftime('%Y-%m-%d'))
+
+
+# Stored result of the last incremental run, or None before the first one
+def load_state_table(state_dir, name):
+    if not table_exists(state_dir, name):
+        return None
+    return load_table(state_dir, name)
+
+
+# Rows a row-level stage (steps 3-4) has to recompute. Returns the rows, the stored
+# result to merge them into (None for a full rebuild) and the pending ID keys.
+def select_pending_rows(data, state_dir, stage):
+    full, keys = get_pending(state_dir, stage)
+    previous = None if full else load_state_table(state_dir, stage)
+    if previous is None:
+        return data, None, keys
+    data_keys = id_keys(data['ID'])
+    return data[data_keys.isin(keys) | data_keys.isna()].copy(), previous, keys
+
+
+# Items of the trucks select_pending_rows picked, and the stored items to merge them
+# into (None for a full rebuild)
+def select_pending_items(items, state_dir, name, keys, full):
+    previous = None if full else load_state_table(state_dir, name)
+    if previous is None:
+        return items, None
+    item_keys = id_keys(items['ID'])
+    return items[item_keys.isin(keys) | item_keys.isna()].copy(), previous
+
+
+# Merge a row-level stage's recomputed rows into its stored result and mark its work done
+def finish_row_stage(data, previous, keys, order_ids, state_dir, stage):
+    merged = merge_by_id(previous, data, keys, order_ids=order_ids)
+    save_table(merged, state_dir, stage)
+    clear_pending(state_dir, stage)
+    return merged
+
+
+# Replace the rows of an aggregate table (daily cube or rollup) whose period is in
+# keys with the recomputed rows; to_key turns key_column values into those keys
+def merge_by_period(previous, recomputed, keys, key_column, to_key):
+    if previous is None:
+        return recomputed
+    keep = previous[~to_key(previous[key_column]).isin(keys)]
+    columns = list(previous.columns) + [col for col in recomputed.columns if col not in previous.columns]
+    # Leave out an empty part so it has no say in the dtypes of the result
+    parts = [part for part in (keep, recomputed) if len(part)] or [keep]
+    merged = pd.concat(parts, ignore_index=True).reindex(columns=columns)
+    return merged.sort_values(key_column, kind='stable').reset_index(drop=True)
+
+
+# =====================
+# Pending work per stage
+# =====================
+def read_pending(state_dir):
+    path = os.path.join(state_dir, PENDING_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_pending(state_dir, pending):
+    path = os.path.join(state_dir, PENDING_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(pending, f, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+# Queue work for the downstream stages; full=True asks them to rebuild everything
+def add_pending(state_dir, ids=(), dates=(), full=False):
+    pending = read_pending(state_dir)
+    for stage, values in [(stage, ids) for stage in ROW_STAGES] + [(stage, dates) for stage in DATE_STAGES]:
+        work = pending.setdefault(stage, {'full': False, 'keys': []})
+        work['full'] = work['full'] or full
+        work['keys'] = [] if work['full'] else sorted(set(work['keys']) | set(values))
+    _write_pending(state_dir, pending)
+
+
+# Work queued for a stage as (full, keys)
+def get_pending(state_dir, stage):
+    work = read_pending(state_dir).get(stage, {'full': False, 'keys': []})
+    return work['full'], set(work['keys'])
+
+
+def clear_pending(state_dir, stage):
+    pending = read_pending(state_dir)
+    pending[stage] = {'full': False, 'keys': []}
+    _write_pending(state_dir, pending)
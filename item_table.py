@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+from incremental import id_keys
+
+# =====================
+# ITEM TABLE
+# =====================
+# Cargo items are kept in a tidy table with one row per (truck, item) instead of
+# item_N / item_N_kg / item_N_kcal / item_N_matched columns on every truck, so a
+# single long manifest no longer widens the whole truck table. Items point at
+# their truck through ('ID', 'truck_seq'), where truck_seq numbers the rows that
+# share an ID. Truck totals are group reductions over the item table, and the
+# wide layout is only rebuilt for the exported workbook.
+
+# Item table whose items are spread back into each truck sheet of the exported workbook
+SHEET_ITEMS = {
+    'unrwa_clean': 'unrwa_items',
+    'unrwa_trucks_kcal': 'unrwa_items_kcal',
+    'unrwa_trucks_kcal_mt': 'unrwa_items_kcal',
+}
+
+# Wide columns rebuilt on export from the item table columns, in workbook order
+WIDE_ITEM_VALUES = [('kg', '_kg'), ('kcal', '_kcal')]
+WIDE_ITEM_MATCHED = ('matched', '_matched')
+
+
+# Number the rows sharing an ID (rows without an ID count as one group)
+def number_trucks(data):
+    keys = id_keys(data['ID']).fillna('')
+    return keys.groupby(keys).cumcount()
+
+
+# Split 'cargo' on '+' or ';' into one cleaned, lower-case item per row.
+# Empty pieces (e.g. a trailing ';') are kept as '' so item counts match the sheet.
+def split_items(data):
+    pieces = data['cargo'].str.replace('+', ';', regex=False).str.split(';').explode()
+    pieces = pieces[pieces.notna()]
+    item = pieces.str.strip() \
+        .str.replace('(', '', regex=False).str.replace(')', '', regex=False).str.replace('"', '', regex=False) \
+        .str.strip().str.lower()
+
+    items = pd.DataFrame({
+        'ID': data.loc[pieces.index, 'ID'].values,
+        'truck_seq': data.loc[pieces.index, 'truck_seq'].values,
+        'item_index': item.groupby(level=0).cumcount().values + 1,
+        'item': item.values,
+    })
+    return items
+
+
+# Position in trucks of the truck each item belongs to (-1 if it has none)
+def truck_rows(trucks, items):
+    truck_index = pd.MultiIndex.from_arrays([id_keys(trucks['ID']).fillna('').values, trucks['truck_seq'].values])
+    item_index = pd.MultiIndex.from_arrays([id_keys(items['ID']).fillna('').values, items['truck_seq'].values])
+    return truck_index.get_indexer(item_index)
+
+
+# Number of items per truck, optionally only those where mask is True
+def count_per_truck(trucks, items, mask=None, rows=None):
+    rows = truck_rows(trucks, items) if rows is None else rows
+    keep = rows >= 0 if mask is None else (rows >= 0) & np.asarray(mask)
+    return pd.Series(np.bincount(rows[keep], minlength=len(trucks)), index=trucks.index)
+
+
+# Sum of an item column per truck; trucks with no values get NaN, like sum(min_count=1)
+def sum_per_truck(trucks, items, values, rows=None):
+    rows = truck_rows(trucks, items) if rows is None else rows
+    values = pd.Series(np.asarray(values, dtype=float))
+    keep = (rows >= 0) & values.notna().values
+    totals = np.bincount(rows[keep], weights=values[keep], minlength=len(trucks))
+    has_value = np.bincount(rows[keep], minlength=len(trucks)) > 0
+    return pd.Series(np.where(has_value, totals, np.nan), index=trucks.index)
+
+
+# Spread an item column into item_<n><suffix> columns (n = 1..n_items), one row per truck
+def _spread(values, items, rows, n_trucks, n_items, suffix):
+    spread = pd.DataFrame({'row': rows, 'n': items['item_index'].values, 'value': np.asarray(values)})
+    spread = spread[spread['row'] >= 0].pivot(index='row', columns='n', values='value')
+    spread = spread.reindex(index=np.arange(n_trucks), columns=np.arange(1, n_items + 1))
+    spread.columns = [f'item_{n}{suffix}' for n in spread.columns]
+    return spread
+
+
+# Rebuild the wide item columns of the original workbook layout for export: item_1..N
+# before 'item_count' and, for items with kcal results, the _kg/_kcal/_matched columns
+# after it. Weights and kcals are only shown for food items, as before.
+def widen(trucks, items):
+    trucks = trucks.reset_index(drop=True)
+    rows = truck_rows(trucks, items)
+    n_items = int(items['item_index'].max()) if len(items) else 0
+    wide = trucks.drop(columns=['truck_seq'])
+
+    position = wide.columns.get_loc('item_count')
+    before, after = wide.iloc[:, :position], wide.iloc[:, position + 1:]
+    parts = [before, _spread(items['item'], items, rows, len(trucks), n_items, ''), wide[['item_count']]]
+
+    if 'matched' in items.columns:
+        is_food = items['matched'].notna() & (items['matched'] != 'non-food')
+        values = {column: _spread(items[column].where(is_food), items, rows, len(trucks), n_items, suffix)
+                  for column, suffix in WIDE_ITEM_VALUES}
+        # Interleave item_1_kg, item_1_kcal, item_2_kg, ...
+        for n in range(1, n_items + 1):
+            parts.append(pd.concat([values[column][[f'item_{n}{suffix}']] for column, suffix in WIDE_ITEM_VALUES],
+                                   axis=1))
+        column, suffix = WIDE_ITEM_MATCHED
+        parts.append(_spread(items[column], items, rows, len(trucks), n_items, suffix))
+
+    parts.append(after)
+    return pd.concat(parts, axis=1)
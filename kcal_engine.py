@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+import item_table
+import parallel_match
+
+# =====================
+# ITEM-TO-KCAL ENGINE
+# =====================
+# Each distinct cargo item is resolved against the kcal reference once, then
+# weights and kcals for every truck item are computed with array operations.
+
+# Define a custom mapping dictionary for known mismatches
+custom_mapping = {
+    'canned white beans': 'white beans',
+    'canned whit beans': 'white beans',
+    'canned wihte beans': 'white beans',
+    'palmera date': 'dates',
+    'lentis': 'lentils',
+    'lintels': 'lentils',
+    'lentil soup': 'lentils',
+    'red lentils': 'lentils',
+    'vermicelli': 'noodles',
+    'molasses': 'sugar',
+    'peas and carrots': 'peas',
+    'peanut butter': 'peanuts',
+    'date bars': 'dates',
+    'date bar': 'dates',
+    'frozen peas': 'peas',
+    'canned green beans with meat': 'green beans with meat',
+    'chicken broth': 'chicken soup',
+    'cooked beans': 'beans',
+    'cooked meal': 'prepared food',
+    'mixed canned meal': 'prepared food',
+    'food commodity': 'food items',
+    'extra meat': 'meat',
+    'pineapples': 'pineapple',
+    'mango': 'mangoes',
+    # Add more mappings as needed
+}
+
+# List of known non-food items
+non_food_items = set([
+    'mats', 'tents', 'blankets', 'clothes', 'medicines', 'medicine',
+    'hygiene kits', 'sanitary items', 'medical equipment', 'soap',
+    'toothbrushes', 'water filters', 'jerry cans', 'tarpaulins'
+])
+
+# Define a function to singularize words (simple heuristic)
+def singularize(word):
+    if word.endswith('s') and len(word) > 3:
+        return word[:-1]
+    else:
+        return word
+
+
+# Vectorized version of singularize for a Series of strings
+def singularize_series(items):
+    plural = items.str.endswith('s') & (items.str.len() > 3)
+    return items.where(~plural, items.str[:-1])
+
+
+# Items whose closest reference item is at least this similar count as fuzzy matches
+fuzzy_cutoff = 0.85
+
+
+# Resolve one preprocessed item without fuzzy matching. Returns (best_match, match_type),
+# or (mapped_item, None) when the item still has to be fuzzy matched as mapped_item.
+def resolve_direct(item_processed, kcal_index):
+    # Check if item is in custom mapping
+    if item_processed in custom_mapping:
+        mapped_item = custom_mapping[item_processed]
+        if mapped_item is None:
+            return None, 'non-food'  # Explicitly unmatched (non-food)
+    else:
+        mapped_item = item_processed
+
+    # Check if item is a known non-food item
+    if mapped_item in non_food_items:
+        return None, 'non-food'
+
+    # First, try exact match
+    if mapped_item in kcal_index.food_set:
+        return mapped_item, 'exact'
+    return mapped_item, None
+
+
+# Result for the closest reference item found by fuzzy matching
+def fuzzy_result(best_match):
+    if best_match is not None:
+        return best_match, 'fuzzy'
+    return None, 'unmatched'
+
+
+# Resolve each distinct preprocessed item once; returns a table indexed by item.
+# When a match_cache is given, items it already knows skip matching entirely.
+# The items left for fuzzy matching are looked up in the fuzzy index as one batch,
+# split over worker processes when parallel matching is on (see parallel_match.py).
+def resolve_items(items, kcal_index, match_cache=None):
+    distinct = pd.unique(pd.Series(items, dtype=object).dropna())
+    resolved = {}
+    if match_cache is not None:
+        for item in distinct:
+            result = match_cache.get(item)
+            if result is not None:
+                resolved[item] = result
+    new_items = [item for item in distinct if item not in resolved]
+
+    direct = {item: resolve_direct(item, kcal_index) for item in new_items}
+    fuzzy_items = [item for item in new_items if direct[item][1] is None]
+    best_matches = parallel_match.best_matches(kcal_index.fuzzy, [direct[item][0] for item in fuzzy_items],
+                                               cutoff=fuzzy_cutoff)
+    fuzzy = dict(zip(fuzzy_items, best_matches))
+    for item in new_items:
+        resolved[item] = fuzzy_result(fuzzy[item]) if item in fuzzy else direct[item]
+        if match_cache is not None:
+            match_cache.put(item, resolved[item])
+
+    return pd.DataFrame([resolved[item] for item in distinct], index=pd.Index(distinct, name='item_processed'),
+                        columns=['best_match', 'match_type'])
+
+
+# Compute weights, kcals and matches for every item and the totals of every truck.
+# Returns the trucks with their totals, the items with their results, and the
+# sets of unmatched items and units.
+def apply_kcal_values(data, items, kcal_index, match_cache=None):
+    data = data.reset_index(drop=True)
+    items = items.reset_index(drop=True)
+    rows = item_table.truck_rows(data, items)
+
+    # Skip trucks with no items or zero quantity
+    quantity = data['Quantity']
+    active_truck = ~((data['item_count'] == 0) | quantity.isna() | (quantity == 0))
+
+    # Preprocess the items
+    item_text = items['item'].astype(str).where(items['item'].notna())
+    items['item_processed'] = singularize_series(item_text.str.strip().str.lower())
+    items['match_type'] = pd.Series(np.nan, index=items.index, dtype=object)
+    items['matched'] = pd.Series(np.nan, index=items.index, dtype=object)
+    items['kg'] = np.nan
+    items['kcal'] = np.nan
+
+    active = (rows >= 0) & active_truck.values[rows] & items['item'].notna().values & (item_text != '').values
+    long = items.loc[active, ['item', 'item_processed']]
+    long['row'] = rows[active]
+    unmatched_items = set()
+    unmatched_units = set()
+    if not long.empty:
+        # Match each distinct item once and join the result back onto every occurrence
+        resolved = resolve_items(long['item_processed'], kcal_index, match_cache)
+        long = long.join(resolved, on='item_processed')
+
+        is_food = long['match_type'].isin(['exact', 'fuzzy'])
+        unmatched_items.update(long.loc[~is_food, 'item'].astype(str))
+
+        # Per-truck inputs for the weight calculation
+        unit = long['row'].map(data['unit'].astype(str).str.lower())
+        row_quantity = long['row'].map(quantity)
+        donor = long['row'].map(data['Donating Country/ Organization'])
+
+        # Pallet weights from the pallet rules, and item weights from the unit registry in one lookup
+        pallet_weight = kcal_index.units.pallet_weights(long['best_match'], is_food, donor,
+                                                        kcal_index.lookup_pallet_kg(long['best_match']))
+        kg, known_unit = kcal_index.units.item_weights(unit, row_quantity, pallet_weight)
+
+        # Known non-food items are skipped before weighing, so they get no weight and no unit check
+        is_known_non_food = long['match_type'] == 'non-food'
+        kg[is_known_non_food] = np.nan
+        unmatched_units.update(unit[~known_unit & ~is_known_non_food])
+
+        # Calculate item kcal for food items
+        kcal_per_kg = kcal_index.lookup_kcal_per_kg(long['best_match'])
+        items.loc[long.index, 'match_type'] = long['match_type']
+        items.loc[long.index, 'matched'] = long['best_match'].where(is_food, 'non-food')
+        items.loc[long.index, 'kg'] = kg
+        items.loc[long.index, 'kcal'] = np.where(is_food, kg * kcal_per_kg, np.nan)
+
+    # Sum item weights and kcals into truck totals; only food items count towards food weight and kcals
+    is_food_item = items['match_type'].isin(['exact', 'fuzzy'])
+    data['truck_weight_kg'] = item_table.sum_per_truck(data, items, items['kg'], rows=rows).fillna(0)
+    data['truck_food_kg'] = item_table.sum_per_truck(data, items, items['kg'].where(is_food_item), rows=rows).fillna(0)
+    data['truck_kcal'] = item_table.sum_per_truck(data, items, items['kcal'].where(is_food_item), rows=rows).fillna(0)
+    return data, items, unmatched_items, unmatched_units
@@ -0,0 +1,51 @@
+import pandas as pd
+from fuzzy_index import FuzzyIndex
+from units import UnitRegistry
+
+# =====================
+# KCAL REFERENCE INDEX
+# =====================
+# kcal_reference.xlsx is loaded once into plain dicts keyed by food item, with
+# the fallbacks for missing values already applied, so matching and weight code
+# never scan the reference table. Fuzzy matching goes through a FuzzyIndex of the
+# food items (see fuzzy_index.py), and weighing through its unit registry (see units.py).
+
+# Set default pallet weight
+default_pallet_weight = 850  # in kg
+
+
+# units and pallet_rules are the 'units' and 'pallets' sheets of the reference, if it has them
+class KcalIndex:
+    def __init__(self, kcal_ref, units=None, pallet_rules=None):
+        kcal_ref = kcal_ref.copy()
+        kcal_ref['food_item'] = kcal_ref['food_item'].astype(str).str.strip().str.lower()
+
+        # Reference items in file order, for fuzzy matching, and as a set for exact matches
+        self.food_items = kcal_ref['food_item'].tolist()
+        self.food_set = set(self.food_items)
+        self.fuzzy = FuzzyIndex(self.food_items)
+
+        # Calculate average item kcal per kg from kcal_ref
+        self.average_item_kcal_per_kg = kcal_ref['Nutval Kcal KG'].mean()
+        self.default_pallet_weight = default_pallet_weight
+
+        # The first row wins when a food item appears more than once
+        first = kcal_ref.drop_duplicates('food_item').set_index('food_item')
+        kcal_per_kg = pd.to_numeric(first['Nutval Kcal KG'], errors='coerce')
+        pallet_kg = pd.to_numeric(first['pallet_kg'], errors='coerce')
+        self.kcal_per_kg = kcal_per_kg.fillna(self.average_item_kcal_per_kg).to_dict()
+        self.pallet_kg = pallet_kg.fillna(self.default_pallet_weight).to_dict()
+
+        # Units and pallet weights used to weigh items (see units.py)
+        self.units = UnitRegistry(self.default_pallet_weight, units, pallet_rules)
+
+    def __len__(self):
+        return len(self.food_items)
+
+    # Vectorized lookups for a Series of matched items; unknown items get the defaults
+    def lookup_kcal_per_kg(self, matches):
+        return matches.map(self.kcal_per_kg).astype(float).fillna(self.average_item_kcal_per_kg)
+
+    def lookup_pallet_kg(self, matches):
+        return matches.map(self.pallet_kg).astype(float).fillna(self.default_pallet_weight)
+
@@ -0,0 +1,111 @@
+import glob
+import json
+import os
+from kcal_engine import custom_mapping, non_food_items
+from profiling import count
+from store import file_digest
+
+# =====================
+# PERSISTENT MATCH CACHE
+# =====================
+# Remembers normalized item -> (best_match, match_type) across runs. Entries
+# live in memory for the current process and in a JSON file on disk, both keyed
+# by a version hash of kcal_reference.xlsx and the matching rules, so a new
+# reference or mapping starts a fresh cache.
+
+CACHE_FILE_PREFIX = 'match_cache_'
+
+# In-process tier, shared by every MatchCache of the same version
+_memory_tier = {}
+
+
+# Content hash of the kcal reference file plus the custom mapping and non-food list
+def reference_version(kcal_ref_path):
+    digest = file_digest(kcal_ref_path)
+    digest.update(json.dumps(custom_mapping, sort_keys=True).encode('utf-8'))
+    digest.update(json.dumps(sorted(non_food_items)).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class MatchCache:
+    def __init__(self, cache_dir, version):
+        self.cache_dir = cache_dir
+        self.version = version
+        self.path = os.path.join(cache_dir, f"{CACHE_FILE_PREFIX}{version}.json")
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._dirty = False
+
+        self._memory = _memory_tier.setdefault(version, {})
+        self._disk = self._load_disk()
+
+    def _load_disk(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable match cache {self.path}: {e}")
+            return {}
+        if stored.get('version') != self.version:
+            return {}
+        return {item: tuple(result) for item, result in stored.get('matches', {}).items()}
+
+    @property
+    def hits(self):
+        return self.memory_hits + self.disk_hits
+
+    # Return the cached (best_match, match_type) for an item, or None on a miss
+    def get(self, item):
+        if item in self._memory:
+            self.memory_hits += 1
+            count('match_cache_hits')
+            return self._memory[item]
+        if item in self._disk:
+            self.disk_hits += 1
+            count('match_cache_hits')
+            self._memory[item] = self._disk[item]
+            return self._disk[item]
+        self.misses += 1
+        count('match_cache_misses')
+        return None
+
+    def put(self, item, result):
+        result = tuple(result)
+        self._memory[item] = result
+        if self._disk.get(item) != result:
+            self._disk[item] = result
+            self._dirty = True
+
+    # Write new entries to disk and drop cache files of older reference versions.
+    # Entries other processes (e.g. backfill workers) saved since this cache was
+    # loaded are kept; for an item both matched, the entries are the same.
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._disk = dict(self._load_disk(), **self._disk)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.version, 'matches': self._disk}, f, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+        for old_path in glob.glob(os.path.join(self.cache_dir, f"{CACHE_FILE_PREFIX}*.json")):
+            if old_path != self.path:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    # Removed by another process (e.g. a backfill worker) saving at the same time
+                    pass
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'entries': len(self._disk),
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,81 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from fuzzy_index import FuzzyIndex
+from profiling import count, snapshot_counters
+
+# =====================
+# PARALLEL FUZZY MATCHING
+# =====================
+# With UNRWA_MATCH_WORKERS set above 1, step 3 splits the distinct items it has
+# to fuzzy match into chunks of UNRWA_MATCH_CHUNK_SIZE items and matches them in
+# a pool of worker processes, each with its own copy of the fuzzy index. Chunks
+# come back in the order they were sent, so the results are exactly those of a
+# serial run. Batches no bigger than one chunk are matched in the process itself,
+# as starting the pool would cost more than it saves.
+
+WORKERS_ENV = 'UNRWA_MATCH_WORKERS'
+CHUNK_SIZE_ENV = 'UNRWA_MATCH_CHUNK_SIZE'
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+# Number of worker processes: 1 (serial) unless set; 0 or 'auto' uses every core
+def get_workers():
+    value = os.environ.get(WORKERS_ENV, '').strip().lower()
+    if value == '':
+        return 1
+    if value in ('0', 'auto'):
+        return os.cpu_count() or 1
+    workers = int(value)
+    if workers < 0:
+        raise ValueError(f"{WORKERS_ENV} must be 0, 'auto' or a positive number of workers, not {value}.")
+    return workers
+
+
+def get_chunk_size():
+    value = os.environ.get(CHUNK_SIZE_ENV, '').strip()
+    chunk_size = int(value) if value else DEFAULT_CHUNK_SIZE
+    if chunk_size < 1:
+        raise ValueError(f"{CHUNK_SIZE_ENV} must be a positive number of items, not {value}.")
+    return chunk_size
+
+
+# Fuzzy index of the current worker process, built once by _init_worker
+_worker_index = None
+
+
+def _init_worker(choices):
+    global _worker_index
+    _worker_index = FuzzyIndex(choices)
+
+
+# Match one chunk in a worker; returns the matches and the counters bumped while matching
+def _match_chunk(queries, cutoff):
+    counters_before = snapshot_counters()
+    matches = _worker_index.best_matches(queries, cutoff)
+    counters = snapshot_counters()
+    counters.subtract(counters_before)
+    return matches, {name: value for name, value in counters.items() if value}
+
+
+# Closest choice in fuzzy_index for each query, matched in parallel when configured
+def best_matches(fuzzy_index, queries, cutoff=0.85, workers=None, chunk_size=None):
+    workers = get_workers() if workers is None else workers
+    chunk_size = get_chunk_size() if chunk_size is None else chunk_size
+    queries = list(queries)
+    if workers <= 1 or len(queries) <= chunk_size:
+        return fuzzy_index.best_matches(queries, cutoff)
+
+    chunks = [queries[start:start + chunk_size] for start in range(0, len(queries), chunk_size)]
+    workers = min(workers, len(chunks))
+    print(f"Fuzzy matching {len(queries)} items in {len(chunks)} chunks on {workers} worker processes.")
+    matches = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(fuzzy_index.choices,)) as pool:
+        # map() yields chunk results in submission order, whichever worker finishes first
+        for chunk_matches, counters in pool.map(_match_chunk, chunks, repeat(cutoff)):
+            matches.extend(chunk_matches)
+            for name, value in counters.items():
+                count(name, value)
+    return matches
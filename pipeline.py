@@ -0,0 +1,163 @@
+import importlib.util
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import compact
+import stage_cache
+from archive import archive_frame, archive_table
+from profiling import RunReport
+from store import load_table, save_table
+
+# =====================
+# IN-PROCESS PIPELINE RUNNER
+# =====================
+# Runs the numbered scripts as steps of one Python process: each script's run()
+# takes the previous step's table as a DataFrame and returns its own, so pandas
+# is imported once and nothing is re-read from disk between steps. Tables are
+# only written to the store at the checkpoints asked for, and a run can start
+# from any step whose input table was checkpointed by an earlier run.
+
+# inputs/outputs are store table names, in the order run() takes and returns them;
+# archive=True also snapshots the outputs in the archive store (see archive.py)
+# on every run, checkpointed or not; files are the other files run() writes to the
+# data folder, cached along with the outputs (see stage_cache.py)
+Stage = namedtuple('Stage', ['number', 'script', 'inputs', 'outputs', 'archive', 'files'])
+
+STAGES = [
+    Stage(1, '1.download_raw.py', [], ['unrwa_raw'], False, []),
+    Stage(2, '2.processing.py', ['unrwa_raw'], ['unrwa_clean', 'unrwa_items'], False, []),
+    Stage(3, '3.apply_kcal_values.py', ['unrwa_clean', 'unrwa_items'], ['unrwa_trucks_kcal', 'unrwa_items_kcal'], True,
+          ['unmatched_items.txt', 'unmatched_units.txt', 'kcal_reference.xlsx']),
+    Stage(4, '4.calc_truck_kcals_mt.py', ['unrwa_trucks_kcal', 'unrwa_items_kcal'], ['unrwa_trucks_kcal_mt'], True, []),
+    Stage(5, '5.daily_totals.py', ['unrwa_trucks_kcal_mt'], ['unrwa_daily_entries', 'unrwa_daily_cube'], False, []),
+    Stage(6, '6. HA_monthly_mt.py', ['unrwa_daily_cube'],
+          ['monthly_hfa', 'unrwa_weekly_rollup', 'unrwa_monthly_rollup'], False, []),
+    Stage(7, '7.export_workbook.py', [], [], False, []),
+]
+
+# Threads fetching the remote inputs of later steps (scripts with a prefetch(executor) function,
+# and a cancel_prefetch() function to stop it when the run ends early)
+FETCH_WORKERS = 4
+
+# Tables a checkpoint can name
+CHECKPOINT_TABLES = [output for stage in STAGES for output in stage.outputs]
+
+_script_dir = os.path.dirname(os.path.abspath(__file__))
+_modules = {}
+
+
+def get_stage(number):
+    for stage in STAGES:
+        if stage.number == number:
+            return stage
+    raise ValueError(f"There is no step {number}. Steps are numbered 1 to {len(STAGES)}.")
+
+
+# Import a numbered script as a module; the file names aren't valid module names
+def load_stage_module(stage):
+    if stage.number not in _modules:
+        path = os.path.join(_script_dir, stage.script)
+        spec = importlib.util.spec_from_file_location(f"step_{stage.number}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[stage.number] = module
+    return _modules[stage.number]
+
+
+# Run steps numbers (in order) against data_dir. Tables produced in this run are
+# handed over in memory; inputs produced by an earlier run are read from the store.
+# Tables already in memory can be given in inputs. Returns the tables produced, or None
+# if step 1 found the export unchanged. Timings and counters of every step are added to
+# report when one is given.
+def run_pipeline(data_dir, numbers=None, checkpoints=(), force_download=False, report=None, inputs=None):
+    stages = STAGES if numbers is None else [get_stage(number) for number in sorted(set(numbers))]
+    checkpoints = set(checkpoints)
+    unknown = checkpoints - set(CHECKPOINT_TABLES)
+    if unknown:
+        raise ValueError(f"Unknown checkpoint tables {sorted(unknown)}. Choose from {CHECKPOINT_TABLES}.")
+
+    report = report if report is not None else RunReport()
+    # Remote inputs of later steps (the kcal reference of step 3) are fetched and parsed on
+    # threads from the start, while step 1 downloads and reads the Supply Page export
+    executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='fetch')
+    tables = None
+    try:
+        for stage in stages:
+            module = load_stage_module(stage)
+            if hasattr(module, 'prefetch'):
+                module.prefetch(executor)
+        tables = _run_stages(stages, data_dir, checkpoints, force_download, report, dict(inputs or {}))
+        return tables
+    finally:
+        # A run that stopped early (nothing to do, or a failed step) doesn't wait out
+        # the retries of fetches it no longer needs
+        if tables is None:
+            for stage in stages:
+                module = _modules.get(stage.number)
+                if module is not None and hasattr(module, 'cancel_prefetch'):
+                    module.cancel_prefetch()
+        executor.shutdown(wait=True, cancel_futures=tables is None)
+
+
+def _run_stages(stages, data_dir, checkpoints, force_download, report, tables):
+    # Keys of the tables for the stage cache, from the steps that made them or their contents
+    use_cache = stage_cache.is_enabled()
+    table_keys = {}
+    for stage in stages:
+        print(f"=== Step {stage.number}: {stage.script}")
+        module = load_stage_module(stage)
+        stage_name = f"{stage.number}.{stage.outputs[0] if stage.outputs else 'export_workbook'}"
+
+        with report.stage(stage_name) as record:
+            if stage.number == 1:
+                result = module.run(data_dir, force=force_download)
+                if result is None:
+                    print("Nothing to do: the Supply Page export has not changed.")
+                    return None
+            elif stage.number == 7:
+                record['rows_in'] = sum(len(table) for table in tables.values())
+                output_file = module.run(data_dir, tables)
+                print(f"Workbook exported to {output_file}.")
+                continue
+            else:
+                for name in stage.inputs:
+                    if name not in tables:
+                        tables[name] = load_table(data_dir, name)
+                record['rows_in'] = len(tables[stage.inputs[0]])
+                inputs = [tables[name] for name in stage.inputs]
+                result = None
+                if use_cache:
+                    for name in stage.inputs:
+                        if name not in table_keys:
+                            table_keys[name] = stage_cache.table_key(tables[name])
+                    external_inputs = module.cache_inputs() if hasattr(module, 'cache_inputs') else {}
+                    key = stage_cache.stage_key(stage, [table_keys[name] for name in stage.inputs], external_inputs)
+                    result = stage_cache.load_outputs(stage, key, data_dir)
+                if result is not None:
+                    record['cached'] = True
+                    print(f"Step {stage.number} inputs unchanged: outputs loaded from the stage cache.")
+                    if hasattr(module, 'replay'):
+                        module.replay(*inputs, *result, data_dir)
+                    result = tuple(result)
+                else:
+                    result = module.run(*inputs, data_dir)
+                    if use_cache:
+                        stage_cache.save_outputs(stage, key, result if isinstance(result, tuple) else (result,), data_dir)
+                if use_cache:
+                    for name in stage.outputs:
+                        table_keys[name] = stage_cache.output_key(key, name)
+            results = result if isinstance(result, tuple) else (result,)
+            record['rows_out'] = len(results[0])
+            record['memory_mb'] = compact.memory_mb(*results)
+            print(f"Step {stage.number} output uses {record['memory_mb']} MB in memory.")
+
+            for name, table in zip(stage.outputs, results):
+                tables[name] = table
+                if name in checkpoints:
+                    path = save_table(table, data_dir, name)
+                    print(f"Checkpoint '{name}' saved to {path}.")
+                if stage.archive:
+                    archived = archive_table(data_dir, name) if name in checkpoints else archive_frame(data_dir, table, name)
+                    print(f"Archived as {archived}.")
+
+    return tables
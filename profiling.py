@@ -0,0 +1,177 @@
+import cProfile
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+# =====================
+# RUN INSTRUMENTATION
+# =====================
+# Hot paths bump named counters with count(); the pipeline runner wraps each
+# step in RunReport.stage(), which records wall and CPU time, rows in/out, the
+# step's own peak memory and the counters bumped during the step, and can dump a
+# cProfile of it. The report is written as JSON next to the data.
+
+REPORTS_DIRNAME = 'reports'
+
+# Seconds between samples of resident memory where its peak can't be reset
+RSS_SAMPLE_SECONDS = 0.05
+
+# Counters bumped anywhere in the process, e.g. 'fuzzy_match_calls' or 'bytes_written'
+_counters = Counter()
+
+
+def count(name, n=1):
+    _counters[name] += n
+
+
+def count_file_bytes(name, path):
+    if os.path.exists(path):
+        _counters[name] += os.path.getsize(path)
+
+
+# Copy of the counters, e.g. for worker processes to send their counts back to the parent
+def snapshot_counters():
+    return Counter(_counters)
+
+
+# Peak resident memory of the process so far in MB, or None where it can't be read
+def process_peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    if sys.platform == 'darwin':
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+
+# A field of /proc/self/status in kB ('VmRSS' is resident memory now, 'VmHWM' its
+# peak), or None where there is no /proc (macOS, Windows)
+def _status_kb(field):
+    try:
+        with open('/proc/self/status', 'r', encoding='ascii') as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+# Peak resident memory of the process during one step. On Linux the kernel's peak
+# is reset when the step starts (/proc/self/clear_refs); if that isn't allowed,
+# resident memory is sampled on a thread instead. Without /proc there is no value.
+class StagePeakRss:
+    def __init__(self):
+        self.start_kb = _status_kb('VmRSS')
+        self.peak_kb = self.start_kb
+        self._sampler = None
+        if self.start_kb is None:
+            return
+        try:
+            with open('/proc/self/clear_refs', 'w', encoding='ascii') as f:
+                f.write('5')
+        except OSError:
+            self._stop = threading.Event()
+            self._sampler = threading.Thread(target=self._sample, name='rss-sampler', daemon=True)
+            self._sampler.start()
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            self.peak_kb = max(self.peak_kb, _status_kb('VmRSS') or 0)
+
+    # Peak during the step and its growth over the start, both in MB, or (None, None)
+    def stop(self):
+        if self.start_kb is None:
+            return None, None
+        if self._sampler is None:
+            peak_kb = _status_kb('VmHWM')
+        else:
+            self._stop.set()
+            self._sampler.join()
+            peak_kb = max(self.peak_kb, _status_kb('VmRSS') or 0)
+        return round(peak_kb / 1024, 1), round((peak_kb - self.start_kb) / 1024, 1)
+
+
+class RunReport:
+    def __init__(self, profile_dir=None):
+        self.profile_dir = profile_dir
+        self.started = datetime.now()
+        self.stages = []
+
+    # Time one step. The caller fills in record['rows_out'] (and rows_in if unknown upfront).
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        record = {'stage': name, 'status': 'failed', 'rows_in': rows_in, 'rows_out': None}
+        counters_before = Counter(_counters)
+        profiler = cProfile.Profile() if self.profile_dir else None
+        peak_rss = StagePeakRss()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+            record['status'] = 'cached' if record.get('cached') else 'ok'
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            wall = time.perf_counter() - wall_start
+            counters = Counter(_counters)
+            counters.subtract(counters_before)
+            counters = {name: value for name, value in sorted(counters.items()) if value}
+            rows = record['rows_in'] if record['rows_in'] is not None else record['rows_out']
+
+            record['wall_seconds'] = round(wall, 4)
+            record['cpu_seconds'] = round(time.process_time() - cpu_start, 4)
+            record['rows_per_sec'] = round(rows / wall, 1) if rows and wall > 0 else None
+            # The step's own peak, and the peak of the whole process up to the end of the step
+            record['peak_rss_mb'], record['rss_growth_mb'] = peak_rss.stop()
+            record['process_peak_rss_mb'] = process_peak_rss_mb()
+            record['bytes_read'] = counters.pop('bytes_read', 0)
+            record['bytes_written'] = counters.pop('bytes_written', 0)
+            record['counters'] = counters
+            if profiler is not None:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                record['profile'] = os.path.join(self.profile_dir, f"{name}.prof")
+                profiler.dump_stats(record['profile'])
+            self.stages.append(record)
+
+    def to_dict(self):
+        return {
+            'started': self.started.isoformat(timespec='seconds'),
+            'total_wall_seconds': round(sum(stage['wall_seconds'] for stage in self.stages), 4),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'stages': self.stages,
+        }
+
+    # Write the report to <data_dir>/reports/run_report_<timestamp>.json
+    def write(self, data_dir):
+        report_dir = os.path.join(data_dir, REPORTS_DIRNAME)
+        os.makedirs(report_dir, exist_ok=True)
+        path = os.path.join(report_dir, f"run_report_{self.started.strftime('%Y%m%d%H%M%S')}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return path
+
+    # One line per step for the console
+    def summary(self):
+        lines = []
+        for stage in self.stages:
+            rows = stage['rows_out'] if stage['rows_out'] is not None else '-'
+            memory = f"{stage['memory_mb']:>9.1f} MB" if stage.get('memory_mb') is not None else ''
+            lines.append(f"{stage['stage']:<28} {stage['status']:<7} {stage['wall_seconds']:>9.2f}s "
+                         f"{rows:>9} rows out {memory}")
+        return "\n".join(lines)
@@ -0,0 +1,201 @@
+import argparse
+import os
+import shutil
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+import pandas as pd
+from fetch import DownloadError, download_file, read_state, write_state
+from kcal_reference import KcalIndex
+from profiling import count, count_file_bytes
+from units import PALLETS_SHEET, UNITS_SHEET
+from store import file_digest, get_cache_dir, write_parquet
+
+# =====================
+# KCAL REFERENCE CACHE
+# =====================
+# kcal_reference.xlsx is kept in UNRWA Truck Data_cache/kcal_reference. Each
+# run asks the server whether the file changed (ETag / Last-Modified, then the
+# SHA-256 of the content), so an unchanged reference costs a 304 and no parse.
+# Every version is kept under versions/<version>.xlsx next to Parquet copies of
+# the columns the kcal index uses and of the unit and pallet sheets, which load in
+# milliseconds. If the server
+# can't be reached, the last version is used. Set UNRWA_KCAL_REFERENCE_VERSION
+# to a version to run against it without going to the network at all.
+
+REFERENCE_DIRNAME = 'kcal_reference'
+STATE_FILE = 'state.json'
+
+# Set to a version (or a prefix of one) to pin the kcal reference
+PIN_VERSION_ENV = 'UNRWA_KCAL_REFERENCE_VERSION'
+
+# Kcal indexes being fetched ahead of step 3 by prefetch(), by URL
+_prefetched = {}
+
+# Set by cancel_prefetch() to stop the downloads of prefetches
+_cancel = threading.Event()
+
+# Columns of the reference kept in the parsed copy
+REFERENCE_COLUMNS = ['food_item', 'Nutval Kcal KG', 'pallet_kg']
+
+# Sheets of the unit registry kept alongside (see units.py)
+UNIT_SHEETS = [UNITS_SHEET, PALLETS_SHEET]
+
+
+def get_reference_dir():
+    reference_dir = os.path.join(get_cache_dir(), REFERENCE_DIRNAME)
+    os.makedirs(os.path.join(reference_dir, 'versions'), exist_ok=True)
+    return reference_dir
+
+
+def version_path(reference_dir, version, extension):
+    return os.path.join(reference_dir, 'versions', f"{version}{extension}")
+
+
+# Keep a downloaded reference as a version, parsing it once; returns its version.
+# The unit and pallet sheets, if the workbook has them, are kept as Parquet too.
+def _add_version(reference_dir, path, sha256):
+    version = sha256[:16]
+    workbook_path = version_path(reference_dir, version, '.xlsx')
+    table_path = version_path(reference_dir, version, '.reference.parquet')
+    if not os.path.exists(table_path):
+        sheets = pd.read_excel(path, sheet_name=None)
+        count('kcal_reference_parses')
+        kcal_ref = next(iter(sheets.values()))
+        missing = [col for col in REFERENCE_COLUMNS if col not in kcal_ref.columns]
+        if missing:
+            raise KeyError(f"The kcal reference is missing the columns {missing}.")
+        shutil.copyfile(path, workbook_path)
+        for sheet in UNIT_SHEETS:
+            if sheet in sheets:
+                write_parquet(sheets[sheet], version_path(reference_dir, version, f".{sheet}.parquet"))
+        # Written last: a version counts as parsed once its reference table exists
+        write_parquet(kcal_ref[REFERENCE_COLUMNS], table_path)
+    return version
+
+
+# Versions kept in the cache, oldest first, as recorded in the state file
+def list_versions():
+    return read_state(os.path.join(get_reference_dir(), STATE_FILE)).get('versions', [])
+
+
+# Full version id for a version or a unique prefix of one
+def resolve_version(prefix):
+    versions = [entry['version'] for entry in list_versions() if entry['version'].startswith(prefix)]
+    if len(set(versions)) != 1:
+        raise ValueError(f"Kcal reference version '{prefix}' {'is ambiguous' if versions else 'is not in the cache'}. "
+                         f"Run python3 reference_cache.py to list the cached versions.")
+    return versions[0]
+
+
+# Bring the cached reference up to date from url (an http(s) URL or a local file,
+# e.g. a stand-in for tests) unless a version is pinned. Returns the version to use.
+# cancel is passed on to download_file.
+def update_reference(url, cancel=None):
+    reference_dir = get_reference_dir()
+    state_path = os.path.join(reference_dir, STATE_FILE)
+    state = read_state(state_path)
+
+    pinned = os.environ.get(PIN_VERSION_ENV, '').strip()
+    if pinned:
+        version = resolve_version(pinned)
+        print(f"Using pinned kcal reference version {version}.")
+        return version
+
+    download_path = os.path.join(reference_dir, 'kcal_reference.xlsx')
+    local_path = url[len('file://'):] if url.startswith('file://') else url
+    try:
+        if os.path.exists(local_path):
+            download_path = local_path
+            fetch_state = {'url': url, 'sha256': file_digest(local_path).hexdigest()}
+        else:
+            fetch_state = download_file(url, download_path, previous_state=state.get('fetch'), cancel=cancel)
+    except DownloadError as e:
+        if not state.get('current'):
+            raise
+        print(f"Could not download the kcal reference ({e}). Using the cached version {state['current']}.")
+        count('kcal_reference_offline')
+        return state['current']
+
+    version = fetch_state['sha256'][:16]
+    if version != state.get('current') or not os.path.exists(version_path(reference_dir, version, '.reference.parquet')):
+        known = any(entry['version'] == version for entry in state.get('versions', []))
+        version = _add_version(reference_dir, download_path, fetch_state['sha256'])
+        versions = [entry for entry in state.get('versions', []) if entry['version'] != version]
+        versions.append({'version': version, 'fetched': datetime.now().isoformat(timespec='seconds'), 'url': url})
+        state['versions'] = versions
+        print(f"{'Back to' if known else 'New'} kcal reference version {version}.")
+    state['current'] = version
+    state['fetch'] = {key: value for key, value in fetch_state.items() if key != 'changed'}
+    write_state(state_path, state)
+    return version
+
+
+# Kcal index of a cached version, from its parsed copy
+def load_version(version):
+    reference_dir = get_reference_dir()
+    tables = {}
+    for name in ['reference'] + UNIT_SHEETS:
+        path = version_path(reference_dir, version, f".{name}.parquet")
+        if os.path.exists(path):
+            count_file_bytes('bytes_read', path)
+            tables[name] = pd.read_parquet(path)
+    return KcalIndex(tables['reference'], units=tables.get(UNITS_SHEET), pallet_rules=tables.get(PALLETS_SHEET))
+
+
+def _fetch_and_load(url, cancel=None):
+    version = update_reference(url, cancel=cancel)
+    return version, load_version(version)
+
+
+# Start bringing the reference at url up to date and loading its index on executor,
+# so get_kcal_reference can pick it up later instead of fetching it then
+def prefetch(url, executor):
+    _cancel.clear()
+    _prefetched[url] = executor.submit(_fetch_and_load, url, _cancel)
+
+
+# Drop the prefetches of a run that stopped before needing them. Downloads still
+# running stop before their next attempt instead of retrying.
+def cancel_prefetch():
+    _cancel.set()
+    for future in _prefetched.values():
+        future.cancel()
+    _prefetched.clear()
+
+
+# Version of the reference at url that get_kcal_reference will load, fetching it now
+# unless prefetch() already started to
+def current_version(url):
+    if url not in _prefetched:
+        future = Future()
+        future.set_result(_fetch_and_load(url))
+        _prefetched[url] = future
+    return _prefetched[url].result()[0]
+
+
+# Kcal index of the reference at url, through the cache. A copy of the workbook of the
+# version used is put in data_dir as kcal_reference.xlsx; returns (index, its path).
+def get_kcal_reference(url, data_dir):
+    future = _prefetched.pop(url, None)
+    version, kcal_index = future.result() if future is not None else _fetch_and_load(url)
+    kcal_ref_path = os.path.join(data_dir, "kcal_reference.xlsx")
+    os.makedirs(data_dir, exist_ok=True)
+    shutil.copyfile(version_path(get_reference_dir(), version, '.xlsx'), kcal_ref_path)
+    return kcal_index, kcal_ref_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="List the cached versions of kcal_reference.xlsx or restore one.")
+    parser.add_argument('--restore', nargs=2, metavar=('VERSION', 'PATH'), help="Write a cached version's workbook to PATH.")
+    args = parser.parse_args()
+
+    if args.restore:
+        version = resolve_version(args.restore[0])
+        shutil.copyfile(version_path(get_reference_dir(), version, '.xlsx'), args.restore[1])
+        print(f"Kcal reference version {version} restored to {args.restore[1]}.")
+    else:
+        current = read_state(os.path.join(get_reference_dir(), STATE_FILE)).get('current')
+        for entry in list_versions():
+            marker = '*' if entry['version'] == current else ' '
+            print(f"{marker} {entry['version']}  {entry['fetched']}  {entry['url']}")
@@ -0,0 +1,71 @@
+import pandas as pd
+import incremental
+from daily_cube import CUBE_DIMENSIONS, CUBE_MEASURES
+
+# =====================
+# WEEKLY AND MONTHLY ROLLUPS
+# =====================
+# The daily cube of step 5 is the day-grain rollup. Step 6 sums it further into
+# an ISO-week rollup and a month rollup with the same dimensions and measures,
+# and reports such as monthly_hfa are projections of a rollup: filter its cells,
+# sum a measure per period and spread one dimension into columns. When some days
+# change, only the weeks and months holding those days are summed again.
+
+# Grain -> period column of its rollup
+ROLLUP_GRAINS = {
+    'day': 'date',
+    'week': 'week',
+    'month': 'month',
+}
+
+
+# Period of each date at a grain: the date, the ISO week as 'YYYY-Www' or the month as a Period
+def period_keys(dates, grain):
+    dates = pd.to_datetime(pd.Series(dates))
+    if grain == 'day':
+        return dates.dt.date
+    if grain == 'week':
+        iso = dates.dt.isocalendar()
+        return iso['year'].astype(str) + '-W' + iso['week'].astype(str).str.zfill(2)
+    if grain == 'month':
+        return dates.dt.to_period('M')
+    raise ValueError(f"Unknown rollup grain '{grain}'. Grains are {', '.join(ROLLUP_GRAINS)}.")
+
+
+# Periods as text, for matching them with period_keys of pending dates
+def period_text(periods):
+    return pd.Series(periods).astype(str)
+
+
+# Sum the daily cube into one row per period and combination of the other dimensions
+def build_rollup(cube, grain):
+    period = ROLLUP_GRAINS[grain]
+    dimensions = [col for col in CUBE_DIMENSIONS if col != 'date' and col in cube.columns]
+    cells = cube.drop(columns='date')
+    cells.insert(0, period, period_keys(cube['date'], grain).values)
+    rollup = cells.groupby([period] + dimensions, dropna=False, observed=True, sort=True)[list(CUBE_MEASURES)].sum()
+    return rollup.reset_index()
+
+
+# Bring a stored rollup up to date after the days in dates changed: the periods
+# holding those days are summed again from the cube and replace their old rows
+def update_rollup(previous, cube, dates, grain):
+    if previous is None:
+        return build_rollup(cube, grain)
+    periods = set(period_text(period_keys(pd.to_datetime(sorted(dates)), grain)))
+    changed = cube[period_text(period_keys(cube['date'], grain)).isin(periods).values]
+    return incremental.merge_by_period(previous, build_rollup(changed, grain), periods, ROLLUP_GRAINS[grain],
+                                       period_text)
+
+
+# Total of a measure per period, with one column per value of the columns dimension.
+# filters keeps only the cells whose dimension has the given value.
+def project(rollup, grain, measure, columns, filters=None):
+    period = ROLLUP_GRAINS[grain]
+    cells = rollup
+    for dimension, value in (filters or {}).items():
+        cells = cells[cells[dimension] == value]
+    totals = cells.groupby([period, columns], observed=True)[measure].sum().unstack(columns)
+    # Plain column names, as a categorical dimension gives a categorical column index
+    totals.columns = list(totals.columns)
+    return totals.fillna(0)
@@ -0,0 +1,174 @@
+import ast
+import glob
+import hashlib
+import json
+import os
+import shutil
+import pandas as pd
+import compact
+import incremental
+from profiling import count, count_file_bytes
+from store import get_cache_dir, table_fingerprint, write_parquet
+
+# =====================
+# STAGE CACHE
+# =====================
+# The outputs of steps 2 to 6 are cached in UNRWA Truck Data_cache/stages under
+# a key hashed from everything a step depends on: the keys of its input tables,
+# its code (the script and every repo module it imports, transitively), compact
+# mode, and inputs from outside the pipeline that a script reports through
+# cache_inputs(), such as the version of kcal_reference.xlsx for step 3. An
+# output's key follows from the key of the step that made it, so only tables
+# that come from outside (step 1, or the store) have their contents hashed.
+# A step whose key is cached loads its outputs instead of running, so after a
+# change to step 6 a run only computes steps 6 and 7. Incremental runs depend on
+# their saved state as well, so they don't use the cache.
+
+STAGES_DIRNAME = 'stages'
+
+# Set to 0 to run every step
+STAGE_CACHE_ENV = 'UNRWA_STAGE_CACHE'
+
+# Cached results kept per step; older ones are removed
+KEEP_ENTRIES = 5
+
+# Part of every key, raised when what an entry holds changes so older entries aren't used
+CACHE_FORMAT = 2
+
+_script_dir = os.path.dirname(os.path.abspath(__file__))
+_code_versions = {}
+
+
+def is_enabled():
+    return os.environ.get(STAGE_CACHE_ENV, '').strip() != '0' and not incremental.is_enabled()
+
+
+def _hash(*parts):
+    digest = hashlib.sha256()
+    digest.update(json.dumps(parts, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+# Repo modules imported by the Python file at path
+def _local_imports(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            names.add(node.module.split('.')[0])
+    return sorted(name for name in names if os.path.exists(os.path.join(_script_dir, f"{name}.py")))
+
+
+# Hash of a script and the repo modules it imports, transitively
+def code_version(script):
+    if script not in _code_versions:
+        digest = hashlib.sha256()
+        seen = set()
+        pending = [script]
+        while pending:
+            file_name = pending.pop()
+            if file_name in seen:
+                continue
+            seen.add(file_name)
+            path = os.path.join(_script_dir, file_name)
+            with open(path, 'rb') as f:
+                digest.update(file_name.encode('utf-8'))
+                digest.update(f.read())
+            pending.extend(f"{name}.py" for name in _local_imports(path))
+        _code_versions[script] = digest.hexdigest()
+    return _code_versions[script]
+
+
+# Key of a table that comes from outside the cached steps, from its contents
+def table_key(table):
+    return table_fingerprint(table)[:32]
+
+
+# Key of a step's run from the keys of its input tables and its external inputs
+def stage_key(stage, input_keys, external_inputs):
+    return _hash(CACHE_FORMAT, stage.script, code_version(stage.script), input_keys, external_inputs,
+                 {'compact': compact.is_enabled()})
+
+
+def output_key(key, name):
+    return _hash(key, name)
+
+
+# Object columns mixing types of values (e.g. int and str IDs). Parquet stores each as
+# one type (see store.py), so their values are also pickled next to the table and put
+# back on load: a cached step hands on the same values as a step that ran.
+def _mixed_columns(table):
+    return [col for col in table.columns
+            if table[col].dtype == object and table[col].dropna().map(type).nunique() > 1]
+
+
+def _entry_dir(stage, key):
+    return os.path.join(get_cache_dir(), STAGES_DIRNAME, str(stage.number), key[:32])
+
+
+# Cached outputs of a step run with key, as a list of tables in stage.outputs order,
+# or None on a miss. The step's cached files are copied back into data_dir.
+def load_outputs(stage, key, data_dir):
+    entry_dir = _entry_dir(stage, key)
+    if not os.path.exists(os.path.join(entry_dir, 'complete')):
+        count('stage_cache_misses')
+        return None
+    try:
+        tables = []
+        for name in stage.outputs:
+            path = os.path.join(entry_dir, f"{name}.parquet")
+            count_file_bytes('bytes_read', path)
+            table = pd.read_parquet(path)
+            mixed_path = os.path.join(entry_dir, f"{name}.mixed.pkl")
+            if os.path.exists(mixed_path):
+                count_file_bytes('bytes_read', mixed_path)
+                mixed = pd.read_pickle(mixed_path)
+                for col in mixed.columns:
+                    table[col] = mixed[col].values
+            tables.append(table)
+        for file_name in stage.files:
+            shutil.copyfile(os.path.join(entry_dir, file_name), os.path.join(data_dir, file_name))
+        # Mark the entry as recently used
+        os.utime(os.path.join(entry_dir, 'complete'))
+    except FileNotFoundError:
+        # Pruned by another process (e.g. a backfill worker) while being read
+        count('stage_cache_misses')
+        return None
+    count('stage_cache_hits')
+    return tables
+
+
+# Cache the outputs of a step run with key, and the files it wrote to data_dir
+def save_outputs(stage, key, tables, data_dir):
+    entry_dir = _entry_dir(stage, key)
+    os.makedirs(entry_dir, exist_ok=True)
+    for name, table in zip(stage.outputs, tables):
+        write_parquet(table, os.path.join(entry_dir, f"{name}.parquet"))
+        mixed = _mixed_columns(table)
+        if mixed:
+            mixed_path = os.path.join(entry_dir, f"{name}.mixed.pkl")
+            table[mixed].reset_index(drop=True).to_pickle(mixed_path)
+            count_file_bytes('bytes_written', mixed_path)
+    for file_name in stage.files:
+        shutil.copyfile(os.path.join(data_dir, file_name), os.path.join(entry_dir, file_name))
+    # Written last: an entry only counts once all of it is there
+    with open(os.path.join(entry_dir, 'complete'), 'w', encoding='utf-8') as f:
+        f.write(key)
+    _prune(stage)
+
+
+# Keep the KEEP_ENTRIES most recently used entries of a step
+def _prune(stage):
+    used = []
+    for marker in glob.glob(os.path.join(get_cache_dir(), STAGES_DIRNAME, str(stage.number), '*', 'complete')):
+        try:
+            used.append((os.path.getmtime(marker), marker))
+        except OSError:
+            # Removed by another process pruning at the same time
+            continue
+    used.sort(reverse=True)
+    for _, marker in used[KEEP_ENTRIES:]:
+        shutil.rmtree(os.path.dirname(marker), ignore_errors=True)
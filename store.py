@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import platform
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from profiling import count_file_bytes
+
+# =====================
+# INTERMEDIATE TABLE STORE
+# =====================
+# The numbered scripts hand their tables to each other as Parquet files in a
+# 'store' folder inside the dated data directory. Each stage only parses the
+# columns it asks for, and the Excel workbook is written once at the end by
+# 7.export_workbook.py.
+
+STORE_DIRNAME = 'store'
+
+# Tables in the order they appear as sheets in the exported workbook
+WORKBOOK_SHEETS = [
+    'unrwa_clean',
+    'unrwa_trucks_kcal',
+    'unrwa_trucks_kcal_mt',
+    'unrwa_daily_entries',
+    'monthly_hfa',
+]
+
+# Comma-separated list of the sheets step 7 exports, when not all of them
+EXPORT_SHEETS_ENV = 'UNRWA_EXPORT_SHEETS'
+
+
+# Set to a folder to keep the data folders there instead of on the desktop (e.g. on a Linux test box)
+DATA_ROOT_ENV = 'UNRWA_DATA_ROOT'
+
+
+# Determine the user's desktop location (macOS and Windows compatibility)
+def get_desktop():
+    if os.environ.get(DATA_ROOT_ENV):
+        return os.environ[DATA_ROOT_ENV]
+    if platform.system() in ("Darwin", "Windows"):
+        return os.path.join(os.path.expanduser("~"), "Desktop")
+    raise Exception("Unsupported operating system. This script works on macOS and Windows only.")
+
+
+# Resolve the "UNRWA Truck Data_YYYYMMDD" folder on the user's desktop
+def get_data_dir(current_date=None):
+    if current_date is None:
+        current_date = datetime.now().strftime('%Y%m%d')
+    folder_name = f"UNRWA Truck Data_{current_date}"
+    return os.path.join(get_desktop(), folder_name)
+
+
+# Date (YYYYMMDD) of a dated data folder, or None if its name doesn't end with one
+def get_run_date(data_dir):
+    run_date = os.path.basename(os.path.normpath(data_dir))[-8:]
+    return run_date if run_date.isdigit() else None
+
+
+# Folder shared by all dated runs for caches that outlive a single day
+def get_cache_dir():
+    cache_dir = os.path.join(get_desktop(), "UNRWA Truck Data_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def table_path(data_dir, name):
+    return os.path.join(data_dir, STORE_DIRNAME, f"{name}.parquet")
+
+
+def table_exists(data_dir, name):
+    return os.path.exists(table_path(data_dir, name))
+
+
+# Column names of a stored table, read from the Parquet footer only
+def table_columns(data_dir, name):
+    return pq.read_schema(table_path(data_dir, name)).names
+
+
+# Parquet needs one type per column; free-text sheet columns sometimes mix
+# numbers, dates and strings, so those are stored as strings
+def _coerce_mixed_columns(data):
+    data = data.copy()
+    for col in data.columns:
+        if data[col].dtype != object:
+            continue
+        values = data[col].dropna()
+        kinds = set(values.map(type))
+        if len(kinds) > 1 and not all(issubclass(kind, (int, float)) for kind in kinds):
+            data[col] = data[col].where(data[col].isna(), data[col].astype(str))
+    return data
+
+
+# Write a table to a Parquet file at path
+def write_parquet(data, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first so a failed stage never leaves a half-written table
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    _coerce_mixed_columns(data).to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    count_file_bytes('bytes_written', path)
+    return path
+
+
+# SHA-256 digest of the contents of the file at path, read a chunk at a time.
+# More data can be fed to the digest before reading it.
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest
+
+
+# Fingerprint of a table's rows, from their values, column names and types
+def table_fingerprint(data):
+    digest = hashlib.sha256()
+    digest.update(json.dumps([[col, str(data[col].dtype)] for col in data.columns]).encode('utf-8'))
+    digest.update(np.ascontiguousarray(pd.util.hash_pandas_object(data, index=False).values).tobytes())
+    return digest.hexdigest()
+
+
+def save_table(data, data_dir, name):
+    return write_parquet(data, table_path(data_dir, name))
+
+
+# Load a stored table; when columns is given, only those columns that exist are read
+def load_table(data_dir, name, columns=None):
+    path = table_path(data_dir, name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Table '{name}' not found at {path}. Run the previous steps first.")
+    if columns is not None:
+        available = set(table_columns(data_dir, name))
+        columns = [col for col in columns if col in available]
+    count_file_bytes('bytes_read', path)
+    return pd.read_parquet(path, columns=columns)
@@ -0,0 +1,122 @@
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from fetch import read_state, write_state
+from profiling import count_file_bytes
+
+# =====================
+# SUPPLY PAGE READER
+# =====================
+# Reads the 'Supply Page' sheet of the raw export in one read-only pass and
+# repairs the 'Quantity' column with column operations, instead of loading,
+# editing and re-saving the whole workbook with openpyxl.
+
+# Quantities typed into date-formatted cells come back as dates; their serial
+# number counted from this base date is the intended quantity
+QUANTITY_BASE_DATE = pd.Timestamp(datetime(1899, 12, 31))
+
+# Strings read_excel treats as missing by default. Only the other columns get them:
+# in 'Quantity' they are kept as typed and counted as errors.
+NA_STRINGS = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+]
+
+# Each dated folder records which export its raw file was made from; the export
+# only counts as built once step 7 has exported the workbook from it, so a run
+# that stops part way is redone by the next one
+RAW_STATE_FILE = 'unrwa_trucks_raw.json'
+
+
+# Undo date mis-formatting in a raw 'Quantity' column.
+# Returns the repaired column and the same counters the cell-by-cell pass reported.
+def repair_quantity(values):
+    values = values.astype(object)
+    quantity = pd.Series(np.nan, index=values.index, dtype=float)
+
+    # Classify cells by Python type; there are only a handful of distinct types per column
+    kinds = values.map(type)
+    kind_is_date = {kind: issubclass(kind, datetime) for kind in kinds.unique()}
+    kind_is_number = {kind: issubclass(kind, (int, float, np.number)) for kind in kinds.unique()}
+
+    # Preserve legitimate zeros or empty cells
+    is_empty = values.isna() | (kinds.eq(str) & values.eq(''))
+    quantity[is_empty] = 0
+
+    # Cells holding datetime objects, likely due to a date formatting error
+    is_date = kinds.map(kind_is_date) & ~is_empty
+    if is_date.any():
+        dates = pd.to_datetime(values[is_date])
+        quantity[is_date] = (dates - QUANTITY_BASE_DATE).dt.days
+
+    # Cells that already contain a numeric value
+    is_number = kinds.map(kind_is_number) & ~is_empty
+    quantity[is_number] = values[is_number].astype(float)
+
+    # Anything else (text) goes through float(), defaulting to zero when it can't be read
+    errors = []
+    is_other = ~(is_empty | is_date | is_number)
+    for index, value in values[is_other].items():
+        try:
+            quantity[index] = float(value)
+        except (TypeError, ValueError) as e:
+            errors.append((index, value, e))
+            quantity[index] = 0
+
+    counters = {
+        'rows_processed': len(values),
+        'date_cells_corrected': int(is_date.sum()),
+        'errors_encountered': len(errors),
+    }
+    return quantity, counters, errors
+
+
+# Read the 'Supply Page' (or misspelled 'Suppy Page') sheet and repair 'Quantity'
+def read_supply_page(path):
+    count_file_bytes('bytes_read', path)
+    with pd.ExcelFile(path, engine='openpyxl') as workbook:
+        if 'Supply Page' in workbook.sheet_names:
+            sheet_name = 'Supply Page'
+        elif 'Suppy Page' in workbook.sheet_names:
+            sheet_name = 'Suppy Page'
+            print("Sheet 'Suppy Page' read as 'Supply Page'.")
+        else:
+            raise KeyError("Sheet 'Supply Page' not found.")
+        # Missing-value strings ('NA', 'n/a', 'null', 'nan'...) are only read as missing
+        # outside 'Quantity' (see NA_STRINGS)
+        columns = workbook.parse(sheet_name, nrows=0).columns
+        na_values = {col: NA_STRINGS for col in columns if col != 'Quantity'}
+        data = workbook.parse(sheet_name, keep_default_na=False, na_values=na_values)
+
+    if 'Quantity' not in data.columns:
+        raise KeyError("Column 'Quantity' not found in 'Supply Page'.")
+
+    data['Quantity'], counters, errors = repair_quantity(data['Quantity'])
+    for index, value, e in errors:
+        # Report the spreadsheet row, accounting for the header and zero indexing
+        print(f"Error processing 'Quantity' in row {index + 2} ({value!r}): {e}")
+    return data, counters
+
+
+def _raw_state_path(data_dir):
+    return os.path.join(data_dir, RAW_STATE_FILE)
+
+
+# Whether data_dir was built, up to the workbook, from the export with this SHA-256
+def is_built_from(data_dir, sha256):
+    return read_state(_raw_state_path(data_dir)).get('sha256') == sha256 \
+        and os.path.exists(os.path.join(data_dir, "unrwa_trucks_raw.xlsx")) \
+        and os.path.exists(os.path.join(data_dir, "unrwa_trucks.xlsx"))
+
+
+# Record that data_dir's raw file was made from the export with this SHA-256 (step 1)
+def record_raw_export(data_dir, sha256):
+    write_state(_raw_state_path(data_dir), {'pending_sha256': sha256})
+
+
+# Mark the export recorded by step 1 as built, once the workbook is exported (step 7)
+def mark_export_built(data_dir):
+    state = read_state(_raw_state_path(data_dir))
+    if 'pending_sha256' in state:
+        write_state(_raw_state_path(data_dir), {'sha256': state['pending_sha256']})
@@ -0,0 +1,203 @@
+import argparse
+import os
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import xlsxwriter
+from kcal_engine import custom_mapping, non_food_items
+from supply_page import QUANTITY_BASE_DATE
+
+# =====================
+# SYNTHETIC SUPPLY PAGE
+# =====================
+# Generates 'Supply Page' workbooks shaped like the live export, at any size,
+# for benchmarks and tests that must run offline. Rows mix everything the
+# pipeline has to cope with: several items per truck joined with '+' or ';',
+# the misspellings listed in custom_mapping, typos of reference items, non-food
+# and unknown items, mixed units, Quantity cells mangled into dates, empty and
+# text quantities, several crossings and WFP pallets.
+
+SUPPLY_PAGE_COLUMNS = [
+    'ID', 'Crossing', 'Received Date', 'Donation Type', 'Cargo Category',
+    'Description of Cargo', 'Units', 'Quantity', 'Donating Country/ Organization',
+]
+
+# (value, weight) pairs for the categorical columns
+CROSSINGS = [('Kerem Shalom', 55), ('Rafah', 20), ('Zikim', 10), ('Erez', 5), ('Kissufim', 5), ('Gate 96', 5)]
+DONATION_TYPES = [('Humanitarian', 70), ('Private Sector', 20), ('humanitarian ', 5), (None, 5)]
+CARGO_CATEGORIES = [('Food', 60), ('Non-Food', 20), ('Mixed', 15), ('Medical', 5)]
+UNITS = [('Pallets', 45), ('pallets', 5), ('Tons', 10), ('tons', 3), ('MT', 5), ('kg', 10), ('Truck', 10),
+         ('Cartons', 5), ('Boxes', 3), (None, 4)]
+DONORS = [('WFP', 30), ('UNICEF', 15), ('Egypt', 15), ('Jordan', 10), ('WFP/Jordan', 5), ('Qatar', 5),
+          ('UAE', 10), ('Private donor', 10)]
+SEPARATORS = [('+', 40), (' + ', 30), (';', 15), ('; ', 15)]
+
+# Share of generated items drawn from each pool
+ITEM_POOLS = [('reference', 70), ('mapping', 10), ('non_food', 8), ('typo', 7), ('unknown', 5)]
+UNKNOWN_ITEMS = ['generator parts', 'solar panels', 'fuel', 'cooking gas', 'stationery', 'school kits',
+                 'spare parts', 'mixed goods', 'assorted items', 'kitchen sets']
+
+# Share of Quantity cells stored as dates, left empty or typed as text
+DATE_QUANTITY_SHARE = 0.03
+EMPTY_QUANTITY_SHARE = 0.01
+TEXT_QUANTITY_SHARE = 0.005
+
+_repo_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_KCAL_REFERENCE = os.path.join(_repo_dir, 'kcal_reference.xlsx')
+
+
+def _choice(rng, pairs, size):
+    values = [value for value, weight in pairs]
+    weights = np.array([weight for value, weight in pairs], dtype=float)
+    return np.array(values, dtype=object)[rng.choice(len(values), size=size, p=weights / weights.sum())]
+
+
+# Misspell a word by swapping, dropping or doubling one character
+def _typo(rng, word):
+    if len(word) < 4:
+        return word
+    i = rng.randint(1, len(word) - 1)
+    kind = rng.randint(3)
+    if kind == 0:
+        return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+    if kind == 1:
+        return word[:i] + word[i + 1:]
+    return word[:i] + word[i] + word[i:]
+
+
+# Build the item vocabulary: reference items plus the strings the pipeline has to correct
+def _item_pools(rng, kcal_ref_path):
+    food_items = pd.read_excel(kcal_ref_path)['food_item'].dropna().astype(str).str.strip().str.lower()
+    food_items = sorted(set(food_items) - {''})
+    return {
+        'reference': food_items,
+        'mapping': sorted(custom_mapping),
+        'non_food': sorted(non_food_items),
+        'typo': sorted({_typo(rng, item) for item in food_items for _ in range(3)}),
+        'unknown': UNKNOWN_ITEMS,
+    }
+
+
+# Render one item the way it is typed in the sheet: mixed case, parentheses, stray spaces
+def _decorate(rng, item):
+    roll = rng.random_sample()
+    if roll < 0.15:
+        item = item.title()
+    elif roll < 0.20:
+        item = item.upper()
+    elif roll < 0.24:
+        item = f"({item})"
+    elif roll < 0.28:
+        item = f" {item} "
+    return item
+
+
+def _cargo_descriptions(rng, n_rows, pools):
+    # Most trucks carry one or two items, a few carry long manifests
+    item_counts = np.minimum(rng.geometric(0.55, size=n_rows), 8)
+    total = int(item_counts.sum())
+    pool_names = _choice(rng, ITEM_POOLS, total)
+    items = np.empty(total, dtype=object)
+    for name, pool in pools.items():
+        mask = pool_names == name
+        items[mask] = np.array(pool, dtype=object)[rng.randint(len(pool), size=int(mask.sum()))]
+    items = [_decorate(rng, item) for item in items]
+    separators = _choice(rng, SEPARATORS, n_rows)
+
+    descriptions = []
+    start = 0
+    for count, separator in zip(item_counts, separators):
+        descriptions.append(separator.join(items[start:start + count]))
+        start += count
+    return descriptions
+
+
+def _quantities(rng, units):
+    n_rows = len(units)
+    unit = pd.Series(units).fillna('').str.lower().values
+    quantity = np.where(unit == 'pallets', rng.randint(1, 41, size=n_rows), rng.randint(1, 30, size=n_rows))
+    quantity = quantity.astype(object)
+
+    # Tons, kilograms and pallet counts above 40 (dropped by step 2)
+    quantity[np.isin(unit, ['tons', 'mt'])] = np.round(rng.uniform(0.5, 25, size=n_rows), 1)[np.isin(unit, ['tons', 'mt'])]
+    quantity[unit == 'kg'] = rng.randint(50, 20000, size=n_rows)[unit == 'kg']
+    quantity[unit == 'truck'] = 1
+    oversized = (unit == 'pallets') & (rng.random_sample(n_rows) < 0.01)
+    quantity[oversized] = rng.randint(41, 200, size=int(oversized.sum()))
+
+    roll = rng.random_sample(n_rows)
+    is_date = roll < DATE_QUANTITY_SHARE
+    is_empty = (roll >= DATE_QUANTITY_SHARE) & (roll < DATE_QUANTITY_SHARE + EMPTY_QUANTITY_SHARE)
+    is_text = (roll >= DATE_QUANTITY_SHARE + EMPTY_QUANTITY_SHARE) \
+        & (roll < DATE_QUANTITY_SHARE + EMPTY_QUANTITY_SHARE + TEXT_QUANTITY_SHARE)
+    base = QUANTITY_BASE_DATE.to_pydatetime()
+    for index in np.flatnonzero(is_date):
+        quantity[index] = base + timedelta(days=max(1, int(round(quantity[index]))))
+    quantity[is_empty] = None
+    for index in np.flatnonzero(is_text):
+        quantity[index] = rng.choice([str(quantity[index]), f"{quantity[index]} pallets", 'n/a'])
+    return quantity
+
+
+# Generate a synthetic 'Supply Page' as a DataFrame with the live sheet's columns
+def generate_supply_page(n_rows, seed=0, start_date=datetime(2023, 10, 21), days=None,
+                         kcal_ref_path=DEFAULT_KCAL_REFERENCE):
+    rng = np.random.RandomState(seed)
+    # About 150 trucks a day unless a period is given
+    days = days or max(1, n_rows // 150)
+
+    units = _choice(rng, UNITS, n_rows)
+    data = pd.DataFrame({
+        'ID': np.arange(1, n_rows + 1),
+        'Crossing': _choice(rng, CROSSINGS, n_rows),
+        'Received Date': pd.Timestamp(start_date) + pd.to_timedelta(np.sort(rng.randint(days, size=n_rows)), unit='D'),
+        'Donation Type': _choice(rng, DONATION_TYPES, n_rows),
+        'Cargo Category': _choice(rng, CARGO_CATEGORIES, n_rows),
+        'Description of Cargo': _cargo_descriptions(rng, n_rows, _item_pools(rng, kcal_ref_path)),
+        'Units': units,
+        'Quantity': _quantities(rng, units),
+        'Donating Country/ Organization': _choice(rng, DONORS, n_rows),
+    })
+    return data[SUPPLY_PAGE_COLUMNS]
+
+
+# Excel serial number of a date. Excel counts 1900 as a leap year, so serials from
+# 1900-03-01 on are one higher than the days since 1899-12-31; the small serials
+# a quantity turns into when typed into a date cell are the days since 1899-12-31.
+def _excel_serial(value):
+    if value >= datetime(1900, 3, 1):
+        return (value - datetime(1899, 12, 30)).days
+    return (value - datetime(1899, 12, 31)).days
+
+
+# Write the sheet row by row in xlsxwriter's constant-memory mode, so 1M rows fit in memory.
+# Dates, including the mangled Quantity cells, are written as date-formatted serial numbers.
+def write_supply_page(data, path, sheet_name='Supply Page'):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, list(data.columns))
+
+    columns = [data[col].astype(object).where(data[col].notna(), None).tolist() for col in data.columns]
+    for row, values in enumerate(zip(*columns), start=1):
+        for col, value in enumerate(values):
+            if value is None or value == '':
+                continue
+            if isinstance(value, datetime):
+                worksheet.write_number(row, col, _excel_serial(value), date_format)
+            else:
+                worksheet.write(row, col, value)
+    workbook.close()
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic 'Supply Page' workbook.")
+    parser.add_argument('--rows', type=int, default=10000, help="Number of truck rows.")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed gives the same workbook.")
+    parser.add_argument('--output', default='synthetic_supply_page.xlsx', help="Workbook to write.")
+    args = parser.parse_args()
+
+    data = generate_supply_page(args.rows, seed=args.seed)
+    print(f"Synthetic Supply Page with {len(data)} rows written to {write_supply_page(data, args.output)}.")
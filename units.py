@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+# =====================
+# UNIT REGISTRY
+# =====================
+# How much an item weighs follows from the unit and Quantity of its truck. The
+# units and pallet weights are data: the 'units' and 'pallets' sheets of
+# kcal_reference.xlsx, or the default tables below when the reference has no such
+# sheet. Units are looked up once per distinct spelling (case and extra spaces
+# don't matter), and item weights are computed for the whole item table with array
+# operations, so a new unit or alias is a new row, not new code. Units that
+# aren't in the registry are listed in unmatched_units.txt and weigh nothing.
+
+# Weight basis of a unit: 'per_unit' weighs Quantity x kg, 'pallet' weighs
+# Quantity x the pallet weight of the item and 'fixed' weighs kg whatever the Quantity
+UNIT_BASES = ['per_unit', 'pallet', 'fixed']
+
+DEFAULT_UNITS = [
+    {'unit': 'kg', 'basis': 'per_unit', 'kg': 1},
+    {'unit': 'kgs', 'basis': 'per_unit', 'kg': 1},
+    {'unit': 'ton', 'basis': 'per_unit', 'kg': 1000},
+    {'unit': 'tons', 'basis': 'per_unit', 'kg': 1000},
+    {'unit': 'tonne', 'basis': 'per_unit', 'kg': 1000},
+    {'unit': 'tonnes', 'basis': 'per_unit', 'kg': 1000},
+    {'unit': 'mt', 'basis': 'per_unit', 'kg': 1000},
+    {'unit': 'pallet', 'basis': 'pallet', 'kg': np.nan},
+    {'unit': 'pallets', 'basis': 'pallet', 'kg': np.nan},
+    # A whole truck, 14 MT
+    {'unit': 'truck', 'basis': 'fixed', 'kg': 14000},
+]
+
+# Pallet weight of food items, tried in order; the first rule whose donor_contains
+# is in the donor (case-insensitive) and whose food_item is the matched item (blank
+# for any) gives pallet_kg, or the item's pallet_kg in the reference if pallet_kg is
+# blank. Items no rule matches, and non-food items, get the default pallet weight.
+DEFAULT_PALLET_RULES = [
+    # WFP pallets weigh what the reference says for the item
+    {'donor_contains': 'wfp', 'food_item': np.nan, 'pallet_kg': np.nan},
+]
+
+# Sheets of kcal_reference.xlsx holding the two tables
+UNITS_SHEET = 'units'
+PALLETS_SHEET = 'pallets'
+
+
+# Unit spellings as registry keys
+def normalize_units(units):
+    return pd.Series(units).astype(str).str.strip().str.lower().str.replace(r'\s+', ' ', regex=True)
+
+
+def _blank(value):
+    return value is None or (isinstance(value, float) and np.isnan(value)) or str(value).strip() == ''
+
+
+# Units and pallet rules as tables (DataFrames or lists of dicts); None for the defaults
+class UnitRegistry:
+    def __init__(self, default_pallet_kg, units=None, pallet_rules=None):
+        units = pd.DataFrame(DEFAULT_UNITS if units is None else units)
+        units = units[units['unit'].notna()]
+        bad = sorted(set(units['basis']) - set(UNIT_BASES))
+        if bad:
+            raise ValueError(f"Unknown unit bases {bad} in the unit registry. Bases are {', '.join(UNIT_BASES)}.")
+        keys = normalize_units(units['unit']).values
+        self.basis = dict(zip(keys, units['basis']))
+        self.kg = dict(zip(keys, pd.to_numeric(units['kg'], errors='coerce')))
+
+        pallet_rules = pd.DataFrame(DEFAULT_PALLET_RULES if pallet_rules is None else pallet_rules)
+        self.pallet_rules = [
+            {
+                'donor_contains': None if _blank(rule.get('donor_contains')) else str(rule['donor_contains']).strip().lower(),
+                'food_item': None if _blank(rule.get('food_item')) else str(rule['food_item']).strip().lower(),
+                'pallet_kg': None if _blank(rule.get('pallet_kg')) else float(rule['pallet_kg']),
+            }
+            for rule in pallet_rules.to_dict('records')
+        ]
+        self.default_pallet_kg = default_pallet_kg
+
+    # Pallet weight of each item from the pallet rules. reference_pallet_kg holds the
+    # pallet_kg of each item's match in the reference.
+    def pallet_weights(self, best_match, is_food, donor, reference_pallet_kg):
+        donor = pd.Series(donor).astype(str).str.lower()
+        best_match = pd.Series(best_match)
+        weights = pd.Series(np.nan, index=best_match.index)
+        is_food = np.asarray(is_food, dtype=bool)
+        for rule in self.pallet_rules:
+            mask = is_food & weights.isna().values
+            if rule['donor_contains'] is not None:
+                mask &= donor.str.contains(rule['donor_contains'], regex=False).values
+            if rule['food_item'] is not None:
+                mask &= (best_match == rule['food_item']).values
+            weights[mask] = reference_pallet_kg[mask] if rule['pallet_kg'] is None else rule['pallet_kg']
+        return weights.fillna(self.default_pallet_kg)
+
+    # Weight of each item from its truck's unit and quantity and its pallet weight.
+    # Returns the weights (NaN for units not in the registry) and which units are known.
+    def item_weights(self, unit, quantity, pallet_kg):
+        unit = pd.Series(unit)
+        codes, spellings = pd.factorize(unit)
+        keys = normalize_units(list(spellings) + [np.nan])
+        # Code -1 (missing) picks the trailing 'nan' entry
+        basis = pd.Series(keys.map(self.basis).values[codes], index=unit.index)
+        unit_kg = pd.Series(keys.map(self.kg).astype(float).values[codes], index=unit.index)
+        kg = pd.Series(np.select(
+            [basis == 'per_unit', basis == 'pallet', basis == 'fixed'],
+            [quantity * unit_kg, quantity * pallet_kg, unit_kg],
+            default=np.nan,
+        ), index=unit.index)
+        return kg, basis.notna()
+